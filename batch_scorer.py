@@ -0,0 +1,271 @@
+import itertools, numpy
+
+import scheduler
+
+# The number of candidate schedules scored together in one block
+BLOCK_SIZE = 20000
+
+# A time later than any class, used to sort missing meetings to the end
+NO_TIME = 48.0
+
+class SectionTable:
+    """This class holds the meetings of a set of sections as NumPy arrays, with
+    one row per section, padded to the largest number of meetings in any of the
+    sections. Sections whose meeting information is TBA have no valid entries."""
+    def __init__(self, sections):
+        self.sections = list(sections)
+        # Maps each section (by identity) to its row in the arrays
+        self.rows = dict((id(section), row)
+                         for row, section in enumerate(self.sections))
+
+        meeting_lists = [section.meetings or [] for section in self.sections]
+        width = max([len(meetings) for meetings in meeting_lists] + [1])
+        shape = (len(self.sections), width)
+
+        self.start_time = numpy.zeros(shape)
+        self.end_time = numpy.zeros(shape)
+        # The same times in whole minutes, which are summed exactly
+        self.start_minutes = numpy.zeros(shape, dtype=numpy.int64)
+        self.end_minutes = numpy.zeros(shape, dtype=numpy.int64)
+        self.valid = numpy.zeros(shape, dtype=bool)
+        # Whether each time is a whole number stored as an int, which matters
+        # because the scalar path truncates averages of int times
+        self.int_start = numpy.zeros(shape, dtype=bool)
+        self.int_end = numpy.zeros(shape, dtype=bool)
+        # Bit i is set if the meeting is on scheduler.DAYS[i]
+        self.days = numpy.zeros(shape, dtype=numpy.int64)
+        # Whether each section's meeting information is TBA
+        self.tba = numpy.array([section.meetings is None for section in self.sections],
+                               dtype=numpy.int64)
+
+        for row, meetings in enumerate(meeting_lists):
+            for column, meeting in enumerate(meetings):
+                self.start_time[row, column] = meeting.start_time
+                self.end_time[row, column] = meeting.end_time
+                self.start_minutes[row, column] = scheduler.to_minutes(meeting.start_time)
+                self.end_minutes[row, column] = scheduler.to_minutes(meeting.end_time)
+                self.valid[row, column] = True
+                self.int_start[row, column] = isinstance(meeting.start_time, (int, long))
+                self.int_end[row, column] = isinstance(meeting.end_time, (int, long))
+                for day_index, day in enumerate(scheduler.DAYS):
+                    if day in meeting.days:
+                        self.days[row, column] |= 1 << day_index
+
+    def row(self, section):
+        """Returns the row of the given section."""
+        return self.rows[id(section)]
+
+class BatchStatistics:
+    """This class holds the statistics of a block of schedules as arrays, with
+    the same attribute names as Schedule, so that the key functions of a
+    scheduler.Ranking can be applied to it directly."""
+    def __init__(self, section_indices, earliest_time, latest_time,
+                 average_start, average_end, gap_count, days_of_class, tba_count):
+        self.section_indices = section_indices
+        self.earliest_time = earliest_time
+        self.latest_time = latest_time
+        self.average_start = average_start
+        self.average_end = average_end
+        self.gap_count = gap_count
+        self.days_of_class = days_of_class
+        self.tba_count = tba_count
+
+    def fill(self, schedule_object, i):
+        """Stores the statistics of the i-th schedule in a schedule object."""
+        schedule_object.earliest_time = self.earliest_time[i].item()
+        schedule_object.latest_time = self.latest_time[i].item()
+        schedule_object.average_start = self.average_start[i].item()
+        schedule_object.average_end = self.average_end[i].item()
+        schedule_object.gap_count = self.gap_count[i].item()
+        schedule_object.days_of_class = self.days_of_class[i].item()
+        schedule_object.tba_count = self.tba_count[i].item()
+
+def compute_average(total, count, all_int):
+    """Averages totals in minutes the way scheduler.get_average_time does:
+    schedules with no meetings average to zero, and averages of int times are
+    truncated."""
+    safe_count = numpy.maximum(count, 1)
+    minutes_per_hour = scheduler.MINUTES_PER_HOUR
+    average = numpy.where(all_int, total // minutes_per_hour // safe_count,
+                          total / (minutes_per_hour * safe_count.astype(float)))
+    return numpy.where(count > 0, average, 0)
+
+def compute_batch_statistics(table, section_indices):
+    """Computes the statistics of a block of schedules given as an integer array
+    of rows in table, identical to those of the scalar path."""
+    section_indices = numpy.asarray(section_indices, dtype=numpy.intp)
+    count = section_indices.shape[0]
+
+    # Gather each schedule's meetings into arrays of shape
+    # (schedules, sections per schedule * meetings per section), in the order
+    # the scalar path visits them
+    start_minutes = table.start_minutes[section_indices].reshape(count, -1)
+    end_minutes = table.end_minutes[section_indices].reshape(count, -1)
+    start_time = table.start_time[section_indices].reshape(count, -1)
+    end_time = table.end_time[section_indices].reshape(count, -1)
+    valid = table.valid[section_indices].reshape(count, -1)
+    int_start = table.int_start[section_indices].reshape(count, -1)
+    int_end = table.int_end[section_indices].reshape(count, -1)
+    days = table.days[section_indices].reshape(count, -1)
+
+    # Earliest and latest times, with the same defaults as the scalar path
+    earliest_time = numpy.where(valid, start_time, 24).min(axis=1)
+    latest_time = numpy.where(valid, end_time, 0).max(axis=1)
+
+    # Sums of start and end times in minutes
+    total_start = numpy.where(valid, start_minutes, 0).sum(axis=1)
+    total_end = numpy.where(valid, end_minutes, 0).sum(axis=1)
+    meeting_count = valid.sum(axis=1)
+    average_start = compute_average(total_start, meeting_count,
+                                    (int_start | ~valid).all(axis=1))
+    average_end = compute_average(total_end, meeting_count,
+                                  (int_end | ~valid).all(axis=1))
+
+    # Gaps and days of class, computed one day at a time
+    gap_count = numpy.zeros(count)
+    days_of_class = numpy.zeros(count, dtype=numpy.int64)
+    for day_index in range(len(scheduler.DAYS)):
+        on_day = valid & (days & (1 << day_index) != 0)
+        days_of_class += on_day.any(axis=1)
+        # Sort each schedule's classes on this day by (start, end), with
+        # meetings on other days sorted to the end
+        day_start = numpy.where(on_day, start_time, NO_TIME)
+        day_end = numpy.where(on_day, end_time, NO_TIME)
+        order = numpy.lexsort((day_end, day_start), axis=1)
+        rows = numpy.arange(count)[:, None]
+        day_start = day_start[rows, order]
+        day_end = day_end[rows, order]
+        classes_on_day = on_day.sum(axis=1)
+        day_gap = numpy.zeros(count)
+        for i in range(day_start.shape[1] - 1):
+            has_gap = classes_on_day > i + 1
+            day_gap += numpy.where(has_gap, day_start[:, i+1] - day_end[:, i], 0)
+        gap_count += day_gap
+
+    tba_count = table.tba[section_indices].sum(axis=1)
+
+    return BatchStatistics(section_indices, earliest_time, latest_time,
+                           average_start, average_end, gap_count, days_of_class,
+                           tba_count)
+
+def iter_section_index_tuples(section_lists, table, budget=None):
+    """Yields every conflict-free choice of one section from each list, as a
+    tuple of rows in table, in the order of the scalar depth first search."""
+    candidate_lists = [[(table.row(section), scheduler.get_section_mask(section))
+                        for section in section_list]
+                       for section_list in section_lists]
+    if not candidate_lists:
+        yield ()
+        return
+    last_section_list = len(candidate_lists) - 1
+    current_rows = []
+    occupied = [0]
+    candidates = [iter(candidate_lists[0])]
+    while candidates:
+        depth = len(candidates) - 1
+        for row, mask in candidates[depth]:
+            if budget is not None and not budget.spend():
+                return
+            if mask & occupied[depth]:
+                continue
+            if depth == last_section_list:
+                yield tuple(current_rows) + (row,)
+                continue
+            current_rows.append(row)
+            occupied.append(occupied[depth] | mask)
+            candidates.append(iter(candidate_lists[depth + 1]))
+            break
+        else:
+            candidates.pop()
+            occupied.pop()
+            if current_rows:
+                current_rows.pop()
+
+# The statistics stored for every schedule in a BatchStatistics object
+STATISTIC_NAMES = scheduler.STATISTIC_NAMES
+
+def rank_order(ranking, statistics, discovery_order):
+    """Returns the indices that sort a block of schedules from best to worst
+    under the given scheduler.Ranking, breaking ties by discovery order."""
+    if ranking.custom_key is not None:
+        raise ValueError("Rankings with custom keys cannot be batch scored")
+    key = ranking.key(statistics)
+    # numpy.lexsort sorts by its last key first
+    return numpy.lexsort((discovery_order,) + tuple(reversed(key)))
+
+def select(statistics, indices):
+    """Returns the statistics of the schedules at the given indices. The
+    section_indices of the result hold lists of sections instead of rows."""
+    return BatchStatistics([statistics.section_indices[i] for i in indices],
+                           *[getattr(statistics, name)[indices]
+                             for name in STATISTIC_NAMES])
+
+def concatenate(statistics_list):
+    """Concatenates the statistics of several blocks of schedules."""
+    return BatchStatistics(sum([statistics.section_indices
+                                for statistics in statistics_list], []),
+                           *[numpy.concatenate([getattr(statistics, name)
+                                                for statistics in statistics_list])
+                             for name in STATISTIC_NAMES])
+
+def find_schedules_batched(course_list, section_list, primary_compare=None,
+                           secondary_compare=None, top_k=None, ranking=None,
+                           budget=None, stats=None, constraints=None,
+                           block_size=BLOCK_SIZE):
+    """Returns the same ordered list of schedules as scheduler.find_schedules,
+    but scores candidate schedules in blocks of block_size with NumPy."""
+    if ranking is None:
+        ranking = scheduler.get_comparison_ranking(primary_compare, secondary_compare)
+    max_days = None
+    if constraints is not None:
+        max_days = constraints.max_days
+    if stats is not None:
+        stats.engine = "batch"
+    kept = []
+    kept_order = []
+    discovered = 0
+    for section_lists in scheduler.iter_section_list_combinations(
+            course_list, section_list, stats, constraints):
+        if stats is not None:
+            stats.group_combinations += 1
+        table = SectionTable(section for section_list in section_lists
+                             for section in section_list)
+        index_tuples = iter_section_index_tuples(section_lists, table, budget)
+        while True:
+            block = list(itertools.islice(index_tuples, block_size))
+            if not block:
+                break
+            statistics = compute_batch_statistics(table, block)
+            # Replace the rows of each schedule by its sections, since rows
+            # are only meaningful within this group combination's table
+            statistics.section_indices = [[table.sections[row] for row in rows]
+                                          for rows in block]
+            block_order = numpy.arange(discovered, discovered + len(block))
+            discovered += len(block)
+            if stats is not None:
+                stats.schedules += len(block)
+            # Schedules with more days of class than allowed are dropped
+            if max_days is not None:
+                allowed = numpy.nonzero(statistics.days_of_class <= max_days)[0]
+                statistics, block_order = select(statistics, allowed), block_order[allowed]
+            if top_k is not None:
+                best = rank_order(ranking, statistics, block_order)[:top_k]
+                statistics, block_order = select(statistics, best), block_order[best]
+            kept.append(statistics)
+            kept_order.append(block_order)
+            # Keep only the best top_k schedules found so far
+            if top_k is not None and len(kept) > 1:
+                merged, merged_order = concatenate(kept), numpy.concatenate(kept_order)
+                best = rank_order(ranking, merged, merged_order)[:top_k]
+                kept, kept_order = [select(merged, best)], [merged_order[best]]
+        if budget is not None and budget.exhausted:
+            break
+    if not kept:
+        return []
+    merged, merged_order = concatenate(kept), numpy.concatenate(kept_order)
+    schedule_list = []
+    for i in rank_order(ranking, merged, merged_order)[:top_k]:
+        schedule_object = scheduler.Schedule(tuple(merged.section_indices[i]))
+        merged.fill(schedule_object, i)
+        schedule_list.append(schedule_object)
+    return schedule_list
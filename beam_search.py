@@ -0,0 +1,411 @@
+import heapq, itertools, time
+
+import scheduler
+
+# The number of partial schedules kept after each step of the beam search
+BEAM_WIDTH = 64
+
+# The number of group combinations bounded and ordered together. Combinations
+# are read from the search lazily, a batch at a time, so that a request with
+# very many of them starts searching at once
+COMBINATION_BATCH_SIZE = 256
+
+# The share of each beam kept for the partial schedules that leave the most
+# sections able to fit in the lists still to be picked, rather than for those
+# with the best bounds, so that the beam is less likely to run empty
+FEASIBLE_SHARE = 0.25
+
+# The share of the SearchBudget given to the beam search. The depth first
+# search then spends the rest, starting from the beam search's schedules
+BEAM_BUDGET_SHARE = 0.25
+
+# Keys are compared after rounding to this many decimal places, since bounds
+# are loosened slightly against floating point rounding errors
+KEY_PRECISION = 6
+
+class SeededScheduleHeap(scheduler.BoundedScheduleHeap):
+    """This class is a BoundedScheduleHeap that ignores the schedules appended
+    while seeding is set when they are appended again later."""
+    def __init__(self, top_k, key):
+        scheduler.BoundedScheduleHeap.__init__(self, top_k, key)
+        self.seeding = True
+        self.seeded = set()
+
+    def append(self, schedule_object, order=None):
+        """Offers a schedule to the heap, unless it was seeded already."""
+        if self.seeding:
+            self.seeded.add(order)
+        elif order in self.seeded:
+            return True
+        return scheduler.BoundedScheduleHeap.append(self, schedule_object, order)
+
+def find_schedules_beam(course_list, section_list, ranking, top_k=1, budget=None,
+                        constraints=None, stats=None, beam_width=BEAM_WIDTH):
+    """Returns (schedules, bound), the best top_k schedules found by a beam
+    search followed by the depth first search, and a sort key no worse than any
+    schedule's, or None if it is not known."""
+    if stats is not None:
+        stats.engine = "beam"
+    schedule_heap = SeededScheduleHeap(top_k, ranking.key)
+    beam_budget = None
+    if budget is not None:
+        beam_budget = budget.split(BEAM_BUDGET_SHARE)
+    bound = search_combinations(course_list, section_list, ranking, schedule_heap,
+                                beam_width, beam_budget, stats, constraints)
+    if budget is not None:
+        budget.nodes += beam_budget.nodes
+    schedules = schedule_heap.schedules()
+    if top_k == 1 and is_optimal(schedules, ranking, bound):
+        return schedules, bound
+
+    # Search exactly for the rest of the budget, skipping the schedules the beam
+    # search found. If the search finishes, its schedules are the best
+    schedule_heap.seeding = False
+    start = time.time()
+    for combination_index, section_lists in enumerate(
+            scheduler.iter_section_list_combinations(course_list, section_list, stats,
+                                                     constraints)):
+        scheduler.collect_schedules(section_lists, ranking, schedule_heap,
+                                    (combination_index,), budget, stats, constraints)
+        if budget is not None and budget.exhausted:
+            break
+    if stats is not None:
+        stats.add_time("search", start)
+    schedules = schedule_heap.schedules()
+    if budget is None or not budget.exhausted:
+        if schedules and ranking.can_bound():
+            bound = ranking.key(schedules[0])
+    return schedules, bound
+
+def search_combinations(course_list, section_list, ranking, schedule_heap,
+                        beam_width=BEAM_WIDTH, budget=None, stats=None,
+                        constraints=None):
+    """Appends the schedules found by a beam search over every group combination
+    to schedule_heap. Returns the smallest bound of any combination, or None if
+    it is not known."""
+    can_bound = ranking.can_bound()
+    # Bounds every schedule until every combination has been read
+    global_bound = None
+    if can_bound:
+        global_bound = get_global_bound(course_list, section_list, ranking, constraints)
+    bound = None
+    summaries = {}
+    combinations = enumerate(scheduler.iter_section_list_combinations(
+        course_list, section_list, stats, constraints))
+    complete = False
+    while not complete:
+        # Summarize and bound the next batch of combinations. Lists shared by
+        # several combinations are only summarized once, and are kept with
+        # their summaries so that their ids cannot be reused
+        start = time.time()
+        batch = []
+        for combination_index, section_lists in itertools.islice(
+                combinations, COMBINATION_BATCH_SIZE):
+            if budget is not None and not budget.spend():
+                return global_bound
+            for type_section_list in section_lists:
+                if id(type_section_list) not in summaries:
+                    summaries[id(type_section_list)] = (
+                        type_section_list, scheduler.compute_list_bounds(type_section_list),
+                        scheduler.get_equivalence_classes(type_section_list))
+            list_bounds = [summaries[id(type_section_list)][1]
+                           for type_section_list in section_lists]
+            list_classes = [summaries[id(type_section_list)][2]
+                            for type_section_list in section_lists]
+            combination_bound = None
+            if can_bound:
+                combination_bound = ranking.bound_key(
+                    scheduler.ScheduleStatistics(), scheduler.merge_list_bounds(list_bounds))
+            batch.append([combination_bound, combination_index, list_bounds, list_classes])
+        complete = len(batch) < COMBINATION_BATCH_SIZE
+        if stats is not None:
+            stats.add_time("bound", start)
+        if can_bound:
+            batch.sort(key=lambda combination: combination[:2])
+
+        # Search the batch best bound first. Each bound is tightened with
+        # get_combination_bound just before its combination is searched, which
+        # skips combinations that cannot beat the schedules kept
+        start = time.time()
+        for combination in batch:
+            combination_bound, combination_index, list_bounds, list_classes = combination
+            if can_bound:
+                if not can_keep(schedule_heap, combination_bound):
+                    break
+                combination[0] = get_combination_bound(list_bounds, list_classes,
+                                                       ranking, budget)
+                if budget is not None and budget.exhausted:
+                    break
+                if not can_keep(schedule_heap, combination[0]):
+                    if stats is not None:
+                        stats.pruned += 1
+                    continue
+            if stats is not None:
+                stats.group_combinations += 1
+            # The depth first search finds what the beam misses
+            beam_search_section_lists(list_bounds, list_classes, ranking, schedule_heap,
+                                      (combination_index,), beam_width, budget, stats,
+                                      constraints)
+            if budget is not None and budget.exhausted:
+                break
+        if stats is not None:
+            stats.add_time("search", start)
+
+        # Every schedule belongs to some combination, so the smallest of their
+        # bounds, tightened or not, bounds every schedule once every
+        # combination has been read. Each of them is no better than the
+        # global bound, which is all that bounds the combinations not read
+        if can_bound and batch:
+            batch_bound = min(combination[0] for combination in batch)
+            if bound is None or batch_bound < bound:
+                bound = batch_bound
+        if budget is not None and budget.exhausted and not complete:
+            return global_bound
+    return bound
+
+def get_global_bound(course_list, section_list, ranking, constraints=None):
+    """Returns a sort key no worse than that of any schedule of any group
+    combination, from the most any group of each course could add."""
+    group_options = scheduler.get_group_options(course_list, section_list, constraints)
+    if group_options is None:
+        return None
+    course_bounds = []
+    for options in group_options:
+        group_bounds = [scheduler.merge_list_bounds(
+            [scheduler.compute_list_bounds(type_section_list)
+             for type_section_list in section_lists]) for section_lists in options]
+        course_bounds.append(join_bounds(group_bounds))
+    return ranking.bound_key(scheduler.ScheduleStatistics(),
+                             scheduler.merge_list_bounds(course_bounds))
+
+def join_bounds(bounds_list):
+    """Returns RemainingBounds no tighter than any of those given, for when
+    only one of them is picked. A missing time is kept missing, since a
+    partial schedule with no meetings is bounded best without it."""
+    joined = scheduler.RemainingBounds()
+    if not bounds_list:
+        return joined
+    min_ends = [bounds.min_end for bounds in bounds_list]
+    if None not in min_ends:
+        joined.min_end = min(min_ends)
+    max_starts = [bounds.max_start for bounds in bounds_list]
+    if None not in max_starts:
+        joined.max_start = max(max_starts)
+    for day in scheduler.DAYS:
+        joined.day_capacity[day] = max(bounds.day_capacity[day] for bounds in bounds_list)
+    for bounds in bounds_list:
+        joined.overlapping_days |= bounds.overlapping_days
+    return joined
+
+def can_keep(schedule_heap, key):
+    """Returns True if a schedule with the given sort key, or a better one,
+    could be kept by a BoundedScheduleHeap."""
+    if not schedule_heap.is_full():
+        return True
+    return bool(schedule_heap.heap) and key <= schedule_heap.heap[0].key
+
+def get_combination_bound(list_bounds, list_classes, ranking, budget=None):
+    """Returns a sort key no worse than that of any schedule of a group
+    combination, given the RemainingBounds and equivalence classes of its
+    lists."""
+    combination_bound = ranking.bound_key(scheduler.ScheduleStatistics(),
+                                          scheduler.merge_list_bounds(list_bounds))
+    statistics = scheduler.ScheduleStatistics()
+    for list_index, classes in enumerate(list_classes):
+        remaining = scheduler.merge_list_bounds(list_bounds[:list_index] +
+                                                list_bounds[list_index + 1:])
+        list_bound = None
+        for members in classes:
+            if budget is not None and not budget.spend():
+                return combination_bound
+            statistics.push(members[0][1])
+            section_bound = ranking.bound_key(statistics, remaining)
+            statistics.pop()
+            if list_bound is None or section_bound < list_bound:
+                list_bound = section_bound
+        if list_bound is not None and list_bound > combination_bound:
+            combination_bound = list_bound
+    return combination_bound
+
+def beam_search_section_lists(list_bounds, list_classes, ranking, schedule_heap,
+                              order_prefix=(), beam_width=BEAM_WIDTH, budget=None,
+                              stats=None, constraints=None):
+    """Appends the schedules completed by a beam search over a group
+    combination's section lists to a BoundedScheduleHeap."""
+    max_days = None
+    if constraints is not None:
+        max_days = constraints.max_days
+    can_bound = ranking.can_bound()
+    list_count = len(list_classes)
+    candidates = [[(members[0][1], scheduler.get_section_mask(members[0][1]), members)
+                   for members in classes] for classes in list_classes]
+    # The distinct masks of each list, to count the fits a list still has
+    list_masks = [set(mask for section, mask, members in list_candidates)
+                  for list_candidates in candidates]
+    list_order = sorted(range(list_count), key=lambda index: (len(candidates[index]), index))
+    suffix_bounds = [scheduler.merge_list_bounds([list_bounds[index]
+                                                  for index in list_order[step:]])
+                     for step in range(list_count + 1)]
+
+    # Each state is a tuple of the candidates picked so far, in step order,
+    # and the slots they occupy
+    beam = [((), 0)]
+    feasible_width = int(beam_width * FEASIBLE_SHARE)
+    statistics = scheduler.ScheduleStatistics()
+    for step, list_index in enumerate(list_order):
+        remaining_indices = list_order[step + 1:]
+        children = []
+        for picked, occupied in beam:
+            for section, mask, members in picked:
+                statistics.push(section)
+            for candidate in candidates[list_index]:
+                section, mask, members = candidate
+                if budget is not None and not budget.spend():
+                    return
+                if stats is not None:
+                    stats.nodes += 1
+                    stats.conflict_checks += 1
+                if mask & occupied:
+                    continue
+                new_occupied = occupied | mask
+                if stats is not None:
+                    stats.conflict_checks += len(remaining_indices)
+                # The fewest masks that still fit in any list left to pick,
+                # which is 0 if the partial schedule cannot be completed
+                fits = min([sum(1 for other_mask in list_masks[index]
+                                if not other_mask & new_occupied)
+                            for index in remaining_indices] or [1])
+                if not fits:
+                    continue
+                statistics.push(section)
+                if max_days is None or statistics.days_of_class <= max_days:
+                    if can_bound:
+                        score = ranking.bound_key(statistics, suffix_bounds[step + 1])
+                    else:
+                        partial_schedule = scheduler.Schedule(
+                            tuple(picked_section for picked_section, picked_mask,
+                                  picked_members in picked) + (section,))
+                        statistics.fill(partial_schedule)
+                        score = ranking.key(partial_schedule)
+                    # Like the depth first search, children that cannot beat
+                    # the worst schedule kept are pruned
+                    if can_bound and not can_keep(schedule_heap, score):
+                        if stats is not None:
+                            stats.pruned += 1
+                    else:
+                        children.append((score, -fits, len(children),
+                                         picked + (candidate,), new_occupied))
+                statistics.pop()
+            for candidate in picked:
+                statistics.pop()
+        # Keep the children with the best bounds, and then those of the rest
+        # with the most fits left, breaking ties by bound
+        kept = heapq.nsmallest(beam_width - feasible_width, children)
+        if len(children) > len(kept):
+            kept_indices = set(child[2] for child in kept)
+            kept += heapq.nsmallest(feasible_width,
+                                    [child for child in children
+                                     if child[2] not in kept_indices],
+                                    key=lambda child: (child[1], child[0], child[2]))
+        beam = [(picked, occupied) for score, fits, child_index, picked, occupied
+                in kept]
+        if not beam:
+            return
+
+    # Put the sections of every completed schedule back in the order of the
+    # section lists, and add the best one improved by local search
+    completed = []
+    for picked, occupied in beam:
+        chosen = [None] * list_count
+        for list_index, candidate in zip(list_order, picked):
+            chosen[list_index] = candidate
+        completed.append(chosen)
+    best = min(completed, key=lambda chosen: ranking.key(build_schedule(chosen)))
+    completed.append(improve_schedule(best, candidates, ranking, max_days, budget, stats))
+
+    # Offer every completed schedule to the heap, with the positions of its
+    # sections in their lists
+    offered = set()
+    for chosen in completed:
+        sections = tuple(section for section, mask, members in chosen)
+        if sections in offered:
+            continue
+        offered.add(sections)
+        if stats is not None:
+            stats.leaves += 1
+        order = tuple(members[0][0] for section, mask, members in chosen)
+        for order, concrete_schedule in scheduler.expand_schedule(
+                order, [members for section, mask, members in chosen],
+                build_schedule(chosen)):
+            if stats is not None:
+                stats.schedules += 1
+            if not schedule_heap.append(concrete_schedule, order_prefix + order):
+                break
+
+def build_schedule(chosen):
+    """Returns the schedule object, with its statistics, holding the section of
+    each of the chosen (section, mask, members) candidates."""
+    schedule_object = scheduler.Schedule(tuple(section for section, mask, members
+                                               in chosen))
+    statistics = scheduler.ScheduleStatistics()
+    for section in schedule_object.schedule:
+        statistics.push(section)
+    statistics.fill(schedule_object)
+    return schedule_object
+
+def improve_schedule(chosen, candidates, ranking, max_days=None, budget=None,
+                     stats=None):
+    """Returns the schedule found by a local search that replaces one chosen
+    candidate at a time while that improves the schedule's key."""
+    chosen = list(chosen)
+    best_key = ranking.key(build_schedule(chosen))
+    improved = True
+    while improved:
+        improved = False
+        for list_index in range(len(chosen)):
+            # The statistics and slots of every other list's section stay the
+            # same while this list's candidates are tried
+            occupied = 0
+            statistics = scheduler.ScheduleStatistics()
+            for other_index, (section, mask, members) in enumerate(chosen):
+                if other_index != list_index:
+                    occupied |= mask
+                    statistics.push(section)
+            for candidate in candidates[list_index]:
+                section, mask, members = candidate
+                if candidate is chosen[list_index] or mask & occupied:
+                    continue
+                if budget is not None and not budget.spend():
+                    return chosen
+                if stats is not None:
+                    stats.nodes += 1
+                statistics.push(section)
+                if max_days is None or statistics.days_of_class <= max_days:
+                    trial = chosen[:list_index] + [candidate] + chosen[list_index + 1:]
+                    schedule_object = scheduler.Schedule(tuple(
+                        trial_section for trial_section, trial_mask, trial_members
+                        in trial))
+                    statistics.fill(schedule_object)
+                    key = ranking.key(schedule_object)
+                    if key < best_key:
+                        chosen, best_key, improved = trial, key, True
+                statistics.pop()
+    return chosen
+
+def round_key(key):
+    """Returns a sort key with its numbers rounded to KEY_PRECISION places."""
+    return tuple(round(value, KEY_PRECISION) for value in key)
+
+def get_gap(schedules, ranking, bound):
+    """Returns how far the best schedule's key is from the bound after the count
+    of TBA sections, or None if there is no schedule or bound."""
+    if not schedules or bound is None or len(bound) < 2:
+        return None
+    return max(0.0, round(ranking.key(schedules[0])[1] - bound[1], KEY_PRECISION))
+
+def is_optimal(schedules, ranking, bound):
+    """Returns True if the best schedule found is proven to be the best, because
+    its key is no worse than the bound."""
+    if not schedules or bound is None:
+        return False
+    return round_key(ranking.key(schedules[0])) <= round_key(bound)
@@ -0,0 +1,448 @@
+import functools, itertools, multiprocessing, random, resource, sys, time
+
+import data_scraper, parallel_scheduler, schedule_cache, scheduler
+
+# Department names and section types used in generated catalogs
+DEPARTMENT_NAMES = ["CIS", "MATH", "PHYS", "ECON", "CHEM", "BIOL", "WRIT", "STAT"]
+SECTION_TYPES = ["LEC", "REC", "LAB"]
+
+# The day patterns classes meet on, with the length of each meeting in hours,
+# in the proportions they appear in generated catalogs. Labs meet once a week
+# for three hours
+DAY_PATTERNS = [("MWF", 1), ("MWF", 1), ("TR", 1.5), ("TR", 1.5), ("MW", 1.5)]
+LAB_DAY_PATTERNS = [("M", 3), ("T", 3), ("W", 3), ("R", 3), ("F", 2)]
+
+# The first and last hours at which generated classes may start
+FIRST_START = 8
+LAST_START = 18
+
+# Requests with at most this many schedules are checked against the reference
+ORACLE_SCHEDULES = 200000
+
+def generate_course_data(seed, departments=4, courses=20, groups=(1, 2),
+                         types=(1, 3), sections=(1, 4), start_times=21,
+                         tba_ratio=0.05):
+    """Returns a CourseData object resembling Penn's catalog, generated from the
+    given seed, so that the same arguments always give the same catalog."""
+    random_state = random.Random(seed)
+    half_hours = range(2 * FIRST_START, 2 * LAST_START + 1)
+    start_count = max(1, min(start_times, len(half_hours)))
+    starts = [half_hours[i * (len(half_hours) - 1) // max(1, start_count - 1)]
+              for i in range(start_count)]
+    course_data = data_scraper.CourseData()
+    for department_name in DEPARTMENT_NAMES[:departments]:
+        department = data_scraper.Department()
+        department.name = department_name
+        course_data.add_department(department)
+        for course_index in range(courses):
+            course = data_scraper.Course()
+            course.code = str(100 + 10 * course_index)
+            course.name = "%s %s" % (department_name, course.code)
+            department.add_course(course)
+            section_number = 1
+            for group_index in range(random_state.randint(*groups)):
+                group = data_scraper.Group()
+                for section_type in SECTION_TYPES[:random_state.randint(*types)]:
+                    for section_index in range(random_state.randint(*sections)):
+                        section = data_scraper.Section()
+                        section.section_number = "%03d" % section_number
+                        section_number += 1
+                        section.type = section_type
+                        section.instructor = "STAFF"
+                        if random_state.random() < tba_ratio:
+                            section.meetings = None
+                        else:
+                            section.add_meeting(generate_meeting(random_state, starts,
+                                                                 section_type))
+                        group.add_section(section)
+                course.add_group(group)
+    return course_data
+
+def generate_meeting(random_state, starts, section_type):
+    """Returns a meeting starting on one of the given half hours, with times
+    stored the way data_scraper stores them: whole hours as ints, and other
+    times as floats."""
+    if section_type == "LAB":
+        days, length = random_state.choice(LAB_DAY_PATTERNS)
+    else:
+        days, length = random_state.choice(DAY_PATTERNS)
+    start = random_state.choice(starts)
+    meeting = data_scraper.Meeting()
+    meeting.days = list(days)
+    meeting.start_time = start // 2 if start % 2 == 0 else start / 2.0
+    end_time = meeting.start_time + length
+    meeting.end_time = int(end_time) if end_time == int(end_time) else end_time
+    meeting.location = "TBA"
+    return meeting
+
+def pick_courses(course_data, count, seed):
+    """Returns count courses of the catalog, picked with the given seed."""
+    courses = sorted((course for department in course_data.departments.values()
+                      for course in department.courses.values()),
+                     key=lambda course: (course.department.name, course.code))
+    return random.Random(seed).sample(courses, count)
+
+# The catalogs and requests benchmarked, as (name, catalog arguments, number of
+# courses requested, ranking priorities, top_k)
+BENCHMARKS = [
+    ("small-early", {}, 4, ["early", "minGaps"], 1),
+    ("small-all", {}, 4, ["minGaps", "early"], None),
+    ("medium-gaps", {}, 6, ["minGaps", "early"], 1),
+    ("medium-days", {}, 6, ["minDays", "compact"], 1),
+    ("medium-top10", {}, 6, ["late", "minDays"], 10),
+    ("dense-slots", {"start_times": 6}, 6, ["compact", "minGaps"], 1),
+    ("many-groups", {"groups": (2, 4)}, 6, ["early", "late"], 1),
+    ("many-sections", {"sections": (3, 8)}, 5, ["minGaps", "minDays"], 1),
+    ("heavy-load", {"sections": (2, 5)}, 7, ["minGaps", "early"], 1),
+    ("tba-heavy", {"tba_ratio": 0.3}, 6, ["early", "minGaps"], 1),
+]
+
+# The requests every search function is checked on, as (name, catalog
+# arguments, number of courses requested, ranking priorities, top_k, number of
+# pinned sections, ScheduleConstraints arguments)
+CHECKS = [
+    ("plain", {}, 4, ["early", "minGaps"], 5, 0, {}),
+    ("pinned", {}, 4, ["minGaps", "early"], 5, 2, {}),
+    ("constrained", {"sections": (2, 5)}, 4, ["minDays", "compact"], 5, 0,
+     {"blocked": [("TR", 12, 13.5)], "earliest_time": 9, "latest_time": 20}),
+    ("max-days", {"sections": (2, 5)}, 4, ["late", "minGaps"], None, 0, {"max_days": 4}),
+    ("tba-pinned", {"tba_ratio": 0.3}, 4, ["compact", "minDays"], 3, 1,
+     {"latest_time": 18}),
+]
+
+# The comparators of the original scheduler, which the reference ranks with
+REFERENCE_COMPARATORS = {"early": scheduler.compare_early, "late": scheduler.compare_late,
+                         "compact": scheduler.compare_compact,
+                         "minGaps": scheduler.compare_gaps,
+                         "minDays": scheduler.compare_days}
+
+def reference_schedules(course_list, priorities, top_k=None, section_list=(),
+                        constraints=None):
+    """Returns the schedules find_schedules should return, found without any of
+    its code, or None if there are more than ORACLE_SCHEDULES to rank."""
+    schedule_list = reference_feasible_schedules(course_list, section_list, constraints)
+    if schedule_list is None:
+        return None
+    return reference_sort(schedule_list, priorities)[:top_k]
+
+def reference_feasible_schedules(course_list, section_list=(), constraints=None):
+    """Returns every schedule of the given courses and pinned sections meeting
+    the ScheduleConstraints, in the order the search finds them, or None if
+    there are more than ORACLE_SCHEDULES."""
+    # Courses that only appear through their pinned sections come last
+    courses = list(course_list)
+    for section in section_list:
+        if section.group.course not in courses:
+            courses.append(section.group.course)
+    schedule_list = []
+    for groups in itertools.product(*[course.groups for course in courses]):
+        section_lists = []
+        for group in groups:
+            for section_type, type_sections in group.sections.items():
+                # A pinned section is the only choice for its type
+                candidates = [section for section in type_sections
+                              if section in section_list] or type_sections
+                section_lists.append([section for section in candidates
+                                      if reference_allows(section, constraints)])
+        for sections in iter_conflict_free(section_lists, []):
+            if any(section not in sections for section in section_list):
+                continue
+            schedule_object = reference_statistics(sections)
+            if constraints is not None and constraints.max_days is not None and \
+               schedule_object.days_of_class > constraints.max_days:
+                continue
+            if len(schedule_list) == ORACLE_SCHEDULES:
+                return None
+            schedule_list.append(schedule_object)
+    return schedule_list
+
+def reference_allows(section, constraints):
+    """Returns True if none of a section's meetings break the constraints,
+    comparing their times directly."""
+    if constraints is None or section.meetings is None:
+        return True
+    for meeting in section.meetings:
+        if set(meeting.days) & set(constraints.free_days):
+            return False
+        if constraints.earliest_time is not None and \
+           meeting.start_time < constraints.earliest_time:
+            return False
+        if constraints.latest_time is not None and \
+           meeting.end_time > constraints.latest_time:
+            return False
+        for days, start_time, end_time in constraints.blocked:
+            if set(meeting.days) & set(days) and meeting.start_time < end_time and \
+               start_time < meeting.end_time:
+                return False
+    return True
+
+def reference_sort(schedule_list, priorities):
+    """Returns the schedules ordered by the original comparators of the given
+    criteria, after their number of TBA sections, keeping ties in order."""
+    comparators = [REFERENCE_COMPARATORS[name] for name in priorities]
+    def compare(s1, s2):
+        result = s1.tba_count - s2.tba_count
+        for comparator in comparators:
+            if result != 0:
+                break
+            result = comparator(s1, s2)
+        return (result > 0) - (result < 0)
+    return sorted(schedule_list, key=functools.cmp_to_key(compare))
+
+def reference_pareto(schedule_list):
+    """Returns the schedules no other schedule dominates, in order."""
+    vectors = [(s.tba_count, -s.earliest_time, s.latest_time,
+                s.latest_time - s.earliest_time, s.gap_count, s.days_of_class)
+               for s in schedule_list]
+    def is_dominated(vector):
+        return any(other != vector and
+                   all(value1 <= value2 for value1, value2 in zip(other, vector))
+                   for other in vectors)
+    return [schedule_object for schedule_object, vector in zip(schedule_list, vectors)
+            if not is_dominated(vector)]
+
+def reference_statistics(sections):
+    """Returns a Schedule of the given sections with its statistics computed
+    directly from their meetings."""
+    schedule_object = scheduler.Schedule(tuple(sections))
+    meetings = [meeting for section in sections if section.meetings is not None
+                for meeting in section.meetings]
+    schedule_object.tba_count = len([section for section in sections
+                                     if section.meetings is None])
+    schedule_object.earliest_time = min([meeting.start_time for meeting in meetings] + [24])
+    schedule_object.latest_time = max([meeting.end_time for meeting in meetings] + [0])
+    if meetings:
+        schedule_object.average_start = reference_average(
+            [meeting.start_time for meeting in meetings])
+        schedule_object.average_end = reference_average(
+            [meeting.end_time for meeting in meetings])
+    gap_count = 0
+    days_of_class = 0
+    for day in scheduler.DAYS:
+        day_classes = sorted((meeting.start_time, meeting.end_time)
+                             for meeting in meetings if day in meeting.days)
+        if day_classes:
+            days_of_class += 1
+        day_gap = 0
+        for (start1, end1), (start2, end2) in zip(day_classes, day_classes[1:]):
+            day_gap += start2 - end1
+        gap_count += day_gap
+    schedule_object.gap_count = gap_count
+    schedule_object.days_of_class = days_of_class
+    return schedule_object
+
+def reference_average(times):
+    """Returns the average of times in hours, summed in whole minutes."""
+    total = sum(int(round(hours * 60)) for hours in times)
+    if all(isinstance(hours, (int, long)) for hours in times):
+        return total // 60 // len(times)
+    return float(total) / (60 * len(times))
+
+def sections_overlap(section1, section2):
+    """Returns True if two sections meet on a common day at overlapping times,
+    comparing their start and end times directly. Sections whose meeting
+    information is TBA overlap nothing."""
+    if section1.meetings is None or section2.meetings is None:
+        return False
+    for meeting1 in section1.meetings:
+        for meeting2 in section2.meetings:
+            if set(meeting1.days) & set(meeting2.days) and \
+               meeting1.start_time < meeting2.end_time and \
+               meeting2.start_time < meeting1.end_time:
+                return True
+    return False
+
+def iter_conflict_free(section_lists, chosen):
+    """Yields, in the order of itertools.product, every choice of one section
+    from each list that conflicts with none of the chosen sections or each
+    other."""
+    if len(chosen) == len(section_lists):
+        yield list(chosen)
+        return
+    for section in section_lists[len(chosen)]:
+        if not any(sections_overlap(section, other) for other in chosen):
+            chosen.append(section)
+            for sections in iter_conflict_free(section_lists, chosen):
+                yield sections
+            chosen.pop()
+
+def get_engines():
+    """Returns the engines to benchmark whose dependencies are installed, as
+    (name, function) pairs."""
+    engines = [("dfs", lambda course_list, ranking, top_k, budget:
+                scheduler.find_schedules(course_list, [], ranking=ranking,
+                                         top_k=top_k, budget=budget, engine="dfs")),
+               ("beam", lambda course_list, ranking, top_k, budget:
+                scheduler.find_schedules(course_list, [], ranking=ranking,
+                                         top_k=top_k, budget=budget, engine="beam"))]
+    try:
+        import numpy
+        engines.append(("batch", lambda course_list, ranking, top_k, budget:
+                        scheduler.find_schedules(course_list, [], ranking=ranking,
+                                                 top_k=top_k, budget=budget,
+                                                 engine="batch")))
+    except ImportError:
+        pass
+    return engines
+
+def get_engine(name):
+    """Returns the function of the engine of the given name."""
+    return dict(get_engines())[name]
+
+def run_benchmark(task):
+    """Runs one benchmark with one engine, in a fresh worker process so that its
+    peak memory can be measured on its own. Returns a dictionary of results."""
+    benchmark_index, engine_name, seed = task
+    name, catalog_arguments, course_count, priorities, top_k = BENCHMARKS[benchmark_index]
+    course_data = generate_course_data(seed, **catalog_arguments)
+    scheduler.compile_course_data(course_data)
+    course_list = pick_courses(course_data, course_count, seed)
+    ranking = scheduler.Ranking(priorities)
+    result = {"name": name, "engine": engine_name,
+              "size": scheduler.estimate_search_size(course_list)}
+    # Peak memory is measured above the process's usage before the search, in
+    # kilobytes as reported by getrusage on Linux, after any imports the engine
+    # needs
+    engine = get_engine(engine_name)
+    budget = scheduler.SearchBudget()
+    memory_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    schedules = engine(course_list, ranking, top_k, budget)
+    result["time"] = time.time() - start
+    result["memory"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory_before
+    result["nodes"] = budget.nodes if engine_name in ("dfs", "beam") else None
+    result["schedules"] = len(schedules)
+
+    # Check the schedules against the brute force reference
+    expected = reference_schedules(course_list, priorities, top_k)
+    if expected is not None:
+        result["correct"] = [schedule_object.schedule for schedule_object in schedules] == \
+                            [schedule_object.schedule for schedule_object in expected]
+    return result
+
+def pick_pinned_sections(course_data, course_list, count, seed):
+    """Returns count sections to pin, picked with the given seed: one of the
+    first requested course, and then sections of courses not requested."""
+    random_state = random.Random(seed)
+    courses = [course_list[0]] + [course for course in pick_courses(course_data, 10, seed)
+                                  if course not in course_list]
+    pinned = []
+    for course in courses[:count]:
+        group = random_state.choice(course.groups)
+        section_type = random_state.choice(sorted(group.sections))
+        pinned.append(random_state.choice(group.sections[section_type]))
+    return pinned
+
+def run_check(check_index, seed):
+    """Checks every search function on one of CHECKS against the reference.
+    Returns (function name, correct) pairs, where correct is None if the
+    reference has too many schedules."""
+    name, catalog_arguments, course_count, priorities, top_k, pin_count, \
+        constraint_arguments = CHECKS[check_index]
+    course_data = generate_course_data(seed, **catalog_arguments)
+    scheduler.compile_course_data(course_data)
+    scheduler.COURSE_DATA = course_data
+    course_list = pick_courses(course_data, course_count, seed)
+    section_list = pick_pinned_sections(course_data, course_list, pin_count, seed)
+    constraints = None
+    if constraint_arguments:
+        constraints = scheduler.ScheduleConstraints(**constraint_arguments)
+    ranking = scheduler.Ranking(priorities)
+    feasible = reference_feasible_schedules(course_list, section_list, constraints)
+    if feasible is None:
+        return [("all", None)]
+
+    def get_sections(schedule_list):
+        return [tuple(schedule_object.schedule) for schedule_object in schedule_list]
+    expected = get_sections(reference_sort(feasible, priorities)[:top_k])
+    results = []
+    for engine in get_check_engines():
+        schedules = scheduler.find_schedules(course_list, section_list, ranking=ranking,
+                                             top_k=top_k, engine=engine,
+                                             constraints=constraints)
+        results.append((engine, get_sections(schedules) == expected))
+    results.append(("count", scheduler.count_schedules(course_list, section_list,
+                                                       constraints) == len(feasible)))
+    results.append(("pareto", get_sections(scheduler.pareto_schedules(
+        course_list, section_list, constraints=constraints)) ==
+        get_sections(reference_pareto(feasible))))
+
+    parallel_scheduler.start_worker_pool(course_data, 2)
+    try:
+        results.append(("parallel", get_sections(parallel_scheduler.find_schedules_parallel(
+            course_list, section_list, ranking=ranking, top_k=top_k,
+            constraints=constraints)) == expected))
+    finally:
+        parallel_scheduler.stop_worker_pool()
+
+    # The cache answers for the courses and pinned sections in sorted order. It
+    # is asked to search, to repeat the answer and to re-rank it
+    sorted_courses = sorted(course_list, key=schedule_cache.get_course_key)
+    sorted_sections = sorted(section_list, key=schedule_cache.get_section_key)
+    sorted_feasible = reference_feasible_schedules(sorted_courses, sorted_sections,
+                                                   constraints)
+    correct = True
+    for cache_priorities in [priorities, priorities, list(reversed(priorities))]:
+        schedules = schedule_cache.find_schedules_cached(
+            course_list, section_list, scheduler.Ranking(cache_priorities), top_k,
+            constraints=constraints)
+        correct = correct and get_sections(schedules) == \
+            get_sections(reference_sort(sorted_feasible, cache_priorities)[:top_k])
+    results.append(("cached", correct))
+    return results
+
+def get_check_engines():
+    """Returns the names of the find_schedules engines whose dependencies are
+    installed."""
+    engines = ["dfs", "beam"]
+    try:
+        import numpy
+        engines.append("batch")
+    except ImportError:
+        pass
+    return engines
+
+def format_result(result):
+    """Returns a line of the benchmark report."""
+    line = "%-14s %-6s %14d " % (result["name"], result["engine"], result["size"])
+    line += "%9.3f %10s %8.1f %6d " % (result["time"],
+                                      result["nodes"] if result["nodes"] is not None else "-",
+                                      result["memory"] / 1024.0, result["schedules"])
+    if "correct" not in result:
+        return line + "unchecked"
+    return line + ("ok" if result["correct"] else "MISMATCH")
+
+def main(engine_names=None, seed=0):
+    """Runs every benchmark with each of the given engines and prints a report.
+    Returns False if any engine disagreed with the reference."""
+    engine_names = engine_names or [name for name, engine in get_engines()]
+    tasks = [(benchmark_index, engine_name, seed)
+             for benchmark_index in range(len(BENCHMARKS))
+             for engine_name in engine_names]
+    print "%-14s %-6s %14s %9s %10s %8s %6s %s" % ("benchmark", "engine", "search size",
+                                                  "seconds", "nodes", "peak MB",
+                                                  "found", "oracle")
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    correct = True
+    try:
+        for result in pool.imap(run_benchmark, tasks):
+            print format_result(result)
+            sys.stdout.flush()
+            correct = correct and result.get("correct", True)
+    finally:
+        pool.terminate()
+
+    print
+    print "%-14s %-10s %s" % ("check", "function", "oracle")
+    for check_index in range(len(CHECKS)):
+        for function_name, function_correct in run_check(check_index, seed):
+            print "%-14s %-10s %s" % (CHECKS[check_index][0], function_name,
+                                      {None: "unchecked", True: "ok",
+                                       False: "MISMATCH"}[function_correct])
+            correct = correct and function_correct is not False
+    return correct
+
+if __name__ == "__main__":
+    # Engines may be named on the command line, e.g. "python benchmark.py dfs"
+    if not main(sys.argv[1:]):
+        sys.exit(1)
@@ -0,0 +1,167 @@
+import multiprocessing, time
+
+import scheduler
+
+# The pool of worker processes started by start_worker_pool, and its size
+WORKER_POOL = None
+WORKER_COUNT = 0
+
+# The catalog held by a worker process, sent once when the worker starts
+WORKER_COURSE_DATA = None
+
+# When there are fewer group combinations than this many per worker, each
+# combination is further split by the section picked from its first list
+UNITS_PER_WORKER = 4
+
+def start_worker_pool(course_data, workers=None):
+    """Starts a pool of worker processes for find_schedules_parallel, each with
+    its own copy of course_data. By default there is one worker per CPU."""
+    global WORKER_POOL, WORKER_COUNT
+    stop_worker_pool()
+    WORKER_COUNT = workers or multiprocessing.cpu_count()
+    WORKER_POOL = multiprocessing.Pool(WORKER_COUNT, initialize_worker, (course_data,))
+
+def stop_worker_pool():
+    """Stops the pool of worker processes, if one is running."""
+    global WORKER_POOL, WORKER_COUNT
+    if WORKER_POOL is not None:
+        WORKER_POOL.terminate()
+        WORKER_POOL.join()
+        WORKER_POOL = None
+        WORKER_COUNT = 0
+
+def initialize_worker(course_data):
+    """Stores the catalog in a newly started worker process."""
+    global WORKER_COURSE_DATA
+    WORKER_COURSE_DATA = course_data
+
+def encode_section_list(section_list, positions=None):
+    """Returns a picklable description of a group's list of sections of one
+    type, optionally restricted to the sections at the given positions."""
+    section = section_list[0]
+    group = section.group
+    course = group.course
+    return (course.department.name, course.code, course.groups.index(group),
+            section.type, positions)
+
+def decode_section_list(section_list_id):
+    """Returns the worker's list of sections described by encode_section_list."""
+    department_name, code, group_index, section_type, positions = section_list_id
+    course = WORKER_COURSE_DATA.get_department(department_name).get_course(code)
+    section_list = course.groups[group_index].sections[section_type]
+    if positions is None:
+        return section_list
+    return [section_list[position] for position in positions]
+
+def get_work_units(course_list, section_list, workers, constraints=None):
+    """Splits the search for the given courses and pinned sections into
+    independent work units, in the order the serial search would explore
+    them."""
+    section_lists_by_combination = list(
+        scheduler.iter_section_list_combinations(course_list, section_list,
+                                                 constraints=constraints))
+    if len(section_lists_by_combination) >= workers * UNITS_PER_WORKER:
+        return section_lists_by_combination
+    work_units = []
+    for section_lists in section_lists_by_combination:
+        if not section_lists:
+            work_units.append(section_lists)
+            continue
+        for section in section_lists[0]:
+            work_units.append([[section]] + section_lists[1:])
+    return work_units
+
+def encode_work_unit(section_lists):
+    """Returns a picklable description of a work unit."""
+    encoded = []
+    for section_list in section_lists:
+        full_list = section_list[0].group.sections[section_list[0].type]
+        if section_list is full_list:
+            encoded.append(encode_section_list(full_list))
+        else:
+            encoded.append(encode_section_list(full_list,
+                [full_list.index(section) for section in section_list]))
+    return encoded
+
+def run_work_unit(task):
+    """Searches one work unit in a worker process. Returns the results, the
+    worker's SearchBudget and its SearchStats, if any."""
+    (unit_index, encoded_section_lists, ranking, top_k, limits, collect_stats,
+     constraints) = task
+    section_lists = [decode_section_list(section_list_id)
+                     for section_list_id in encoded_section_lists]
+    schedule_list = scheduler.BoundedScheduleHeap(top_k, ranking.key)
+    # The worker's budget shares the parent's deadline, while its node limit
+    # applies to this unit alone
+    budget = None
+    if limits is not None:
+        deadline, node_limit = limits
+        budget = scheduler.SearchBudget(node_limit=node_limit)
+        budget.deadline = deadline
+    stats = None
+    if collect_stats:
+        stats = scheduler.SearchStats()
+        start = time.time()
+    scheduler.collect_schedules(section_lists, ranking, schedule_list, budget=budget,
+                                stats=stats, constraints=constraints)
+    if stats is not None:
+        stats.add_time("search", start)
+    results = []
+    for key, index, schedule_object in schedule_list.entries():
+        positions = tuple(section_list.index(section) for section_list, section
+                          in zip(section_lists, schedule_object.schedule))
+        results.append((key, unit_index, index, positions,
+                        scheduler.get_statistics(schedule_object)))
+    return results, budget, stats
+
+def find_schedules_parallel(course_list, section_list, primary_compare=None,
+                            secondary_compare=None, top_k=None, ranking=None,
+                            budget=None, stats=None, constraints=None):
+    """Returns the same ordered list of schedules as scheduler.find_schedules,
+    but searches independent work units in the worker pool."""
+    if ranking is None:
+        ranking = scheduler.get_comparison_ranking(primary_compare, secondary_compare)
+    if WORKER_POOL is None or ranking.custom_key is not None:
+        return scheduler.find_schedules(course_list, section_list,
+                                        top_k=top_k, ranking=ranking, budget=budget,
+                                        stats=stats, constraints=constraints)
+
+    start = time.time()
+    work_units = get_work_units(course_list, section_list, WORKER_COUNT, constraints)
+    if stats is not None:
+        stats.engine = "dfs"
+        stats.group_combinations += len(work_units)
+        stats.add_time("groups", start)
+    limits = None
+    if budget is not None:
+        limits = (budget.deadline, budget.node_limit)
+    tasks = [(unit_index, encode_work_unit(section_lists), ranking, top_k, limits,
+              stats is not None, constraints)
+             for unit_index, section_lists in enumerate(work_units)]
+
+    # Sort by key, breaking ties by the order in which the serial search would
+    # have found the schedules, which is the unit order and then the order
+    # within each unit
+    results = []
+    for unit_results, unit_budget, unit_stats in WORKER_POOL.imap_unordered(run_work_unit,
+                                                                            tasks):
+        if unit_budget is not None:
+            budget.nodes += unit_budget.nodes
+            budget.exhausted = budget.exhausted or unit_budget.exhausted
+        if unit_stats is not None:
+            stats.merge(unit_stats)
+        results.extend(unit_results)
+        if top_k is not None:
+            results = sorted(results)[:top_k]
+    results.sort()
+    if top_k is not None:
+        results = results[:top_k]
+
+    # Rebuild the schedules from the parent process's own sections
+    schedule_list = []
+    for key, unit_index, index, positions, statistics in results:
+        section_lists = work_units[unit_index]
+        schedule_list.append(scheduler.build_schedule(
+            tuple(section_list[position] for section_list, position
+                  in zip(section_lists, positions)), statistics))
+    return schedule_list
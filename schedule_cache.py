@@ -0,0 +1,181 @@
+import collections, heapq, time
+
+import parallel_scheduler, scheduler
+
+# The number of schedule requests whose results are kept
+CACHE_SIZE = 1000
+
+# The number of sets of courses whose feasible schedules are kept for
+# re-ranking, and the largest number of feasible schedules kept for one set.
+# Requests for larger sets are searched directly
+FEASIBLE_CACHE_SIZE = 100
+FEASIBLE_SET_LIMIT = 20000
+
+# The share of a request's SearchBudget spent counting its feasible schedules.
+# Sets whose count does not finish within it are searched directly with the
+# rest of the budget
+COUNT_BUDGET_SHARE = 0.1
+
+class ScheduleCache:
+    """This class keeps the results of the most recently used schedule requests,
+    evicting the least recently used result once more than max_size are kept."""
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self.results = collections.OrderedDict()
+        self.course_data = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def check_course_data(self, course_data):
+        """Clears the cache if its results were computed from a different
+        catalog than course_data."""
+        if course_data is not self.course_data:
+            self.clear()
+            self.course_data = course_data
+
+    def get(self, key):
+        """Returns the result stored under key, marking it as most recently
+        used, or None if there is none."""
+        result = self.results.pop(key, None)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.results[key] = result
+        return result
+
+    def put(self, key, result):
+        """Stores a result under key, evicting the least recently used result
+        if the cache is full."""
+        self.results.pop(key, None)
+        self.results[key] = result
+        while len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Forgets every result."""
+        self.results.clear()
+
+    def stats(self):
+        """Returns the cache's counters as a dictionary."""
+        return {"size": len(self.results), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+# The caches used by find_schedules_cached. FEASIBLE_CACHE holds every feasible
+# schedule as a scheduler.CompactScheduleList, or False for sets of courses
+# with too many
+SCHEDULE_CACHE = ScheduleCache()
+FEASIBLE_CACHE = ScheduleCache(FEASIBLE_CACHE_SIZE)
+
+def get_cache_stats():
+    """Returns the counters of both caches as a dictionary."""
+    return {"schedules": SCHEDULE_CACHE.stats(), "feasible": FEASIBLE_CACHE.stats()}
+
+def get_course_key(course):
+    """Returns a key identifying a course within its catalog."""
+    return (course.department.name, course.code)
+
+def get_section_key(section):
+    """Returns a key identifying a section within its catalog."""
+    return get_course_key(section.group.course) + (section.section_number,)
+
+def rank_schedules(schedule_list, ranking, top_k=None):
+    """Returns the best top_k of a scheduler.CompactScheduleList of schedules,
+    ordered the same way find_schedules orders them."""
+    if ranking.custom_key is None:
+        # The keys of a ranking without a custom key only hold statistics, so a
+        # single schedule object can be refilled for every schedule
+        schedule_object = scheduler.Schedule(())
+        keyed_schedules = []
+        for index in range(len(schedule_list)):
+            schedule_list.fill(schedule_object, index)
+            keyed_schedules.append((ranking.key(schedule_object), index))
+    else:
+        keyed_schedules = [(ranking.key(schedule_list.get(index)), index)
+                           for index in range(len(schedule_list))]
+    if top_k is None:
+        keyed_schedules.sort()
+    else:
+        keyed_schedules = heapq.nsmallest(top_k, keyed_schedules)
+    return [schedule_list.get(index) for key, index in keyed_schedules]
+
+def get_feasible_schedules(course_list, section_list, course_set_key, budget=None,
+                           stats=None, constraints=None):
+    """Returns every feasible schedule for the given courses, pinned sections
+    and ScheduleConstraints, or None if there are more than FEASIBLE_SET_LIMIT
+    or they cannot be counted within COUNT_BUDGET_SHARE of the budget."""
+    schedules = FEASIBLE_CACHE.get(course_set_key)
+    if schedules is None:
+        start = time.time()
+        count_budget = None
+        if budget is not None:
+            count_budget = budget.split(COUNT_BUDGET_SHARE)
+        schedule_count = scheduler.count_schedules(course_list, section_list, constraints,
+                                                   count_budget, FEASIBLE_SET_LIMIT)
+        if budget is not None:
+            budget.nodes += count_budget.nodes
+        if stats is not None:
+            stats.add_time("count", start)
+        if schedule_count > FEASIBLE_SET_LIMIT or \
+           (count_budget is not None and count_budget.exhausted):
+            # Sets too large to count quickly are treated like sets with too
+            # many schedules, since listing them would take longer still
+            schedules = False
+        else:
+            # Every schedule ties under an empty ranking, so they are returned
+            # in the order the search finds them
+            if stats is not None:
+                stats.cache = "miss"
+            schedules = scheduler.CompactScheduleList(scheduler.find_schedules(
+                course_list, section_list, ranking=scheduler.Ranking(), budget=budget,
+                stats=stats, constraints=constraints))
+            if budget is not None and budget.exhausted:
+                return schedules
+        FEASIBLE_CACHE.put(course_set_key, schedules)
+    if schedules is False:
+        return None
+    return schedules
+
+def find_schedules_cached(course_list, section_list, ranking, top_k=None, budget=None,
+                          stats=None, constraints=None):
+    """Returns the schedules parallel_scheduler.find_schedules_parallel would
+    return for the courses and pinned sections sorted by name, reusing the
+    results of earlier requests for the same courses."""
+    course_list = sorted(course_list, key=get_course_key)
+    section_list = sorted(section_list, key=get_section_key)
+    SCHEDULE_CACHE.check_course_data(scheduler.COURSE_DATA)
+    FEASIBLE_CACHE.check_course_data(scheduler.COURSE_DATA)
+    course_set_key = (tuple(get_course_key(course) for course in course_list),
+                      tuple(get_section_key(section) for section in section_list),
+                      constraints.describe() if constraints is not None else None)
+
+    description = ranking.describe()
+    if description is not None:
+        key = course_set_key + (description, top_k)
+        schedules = SCHEDULE_CACHE.get(key)
+        if schedules is not None:
+            if stats is not None:
+                stats.cache = "hit"
+            return list(schedules)
+
+    feasible_schedules = get_feasible_schedules(course_list, section_list,
+                                                course_set_key, budget, stats,
+                                                constraints)
+    if feasible_schedules is not None:
+        start = time.time()
+        schedules = rank_schedules(feasible_schedules, ranking, top_k)
+        if stats is not None:
+            stats.cache = stats.cache or "rerank"
+            stats.add_time("rank", start)
+    else:
+        schedules = parallel_scheduler.find_schedules_parallel(
+            course_list, section_list, ranking=ranking, top_k=top_k, budget=budget,
+            stats=stats, constraints=constraints)
+        if stats is not None:
+            stats.cache = "miss"
+    if description is not None and (budget is None or not budget.exhausted):
+        SCHEDULE_CACHE.put(key, schedules)
+    # The caller gets its own copy, so that changing it leaves the cache alone
+    return list(schedules)
@@ -1,11 +1,46 @@
-import data_scraper, os, pickle
+import array, bisect, data_scraper, functools, heapq, itertools, math, os, pickle, time
 
 COURSE_DATA = None
 
-class Schedule:
-    """This class holds a schedule, which is a list of sections, as well as a
+# The days of the week, in the order they are laid out in occupancy bitmasks
+DAYS = "MTWRFSU"
+
+# Each day is divided into 5-minute slots, and a section's occupancy bitmask has
+# one bit set for every slot of the week in which it meets
+SLOTS_PER_HOUR = 12
+SLOTS_PER_DAY = 24 * SLOTS_PER_HOUR
+
+# Tolerance used when converting floating point times into slot indices
+SLOT_EPSILON = 1e-6
+
+# Start and end times are summed in whole minutes, so that the sums are exact
+# whatever order the meetings are added in
+MINUTES_PER_HOUR = 60
+
+# Slack given to optimistic bounds computed with floating point arithmetic, so
+# that rounding errors can never cause a subtree to be pruned incorrectly
+BOUND_EPSILON = 1e-9
+
+# A SearchBudget with a time limit reads the clock once every this many nodes
+TIME_CHECK_INTERVAL = 256
+
+# The counters of a SearchStats object
+STATS_COUNTER_NAMES = ("group_combinations", "groups_rejected", "nodes",
+                       "conflict_checks", "pruned", "leaves", "schedules")
+
+# The engines find_schedules can use: its own depth first search, the
+# approximate beam search in beam_search and the NumPy scorer in batch_scorer.
+# The depth first search is the default, and the others are only used on
+# request
+ENGINES = ("dfs", "beam", "batch")
+
+class Schedule(object):
+    """This class holds a schedule, which is a tuple of sections, as well as a
     number of statistics about the schedule. It takes in a schedule as it is
     initialized and then compute_statistics is called on it."""
+    __slots__ = ("schedule", "earliest_time", "latest_time", "average_start",
+                 "average_end", "gap_count", "days_of_class", "tba_count")
+
     def __init__(self, schedule):
         self.schedule = schedule
         self.earliest_time = 0
@@ -14,6 +49,281 @@ class Schedule:
         self.average_end = 0
         self.gap_count = 0
         self.days_of_class = 0
+        self.tba_count = 0
+
+class RankedSchedule(object):
+    """This class holds the sections, statistics and sort key of a schedule kept
+    in a heap. It compares less than another entry if it ranks worse, so the
+    root of the heap is the worst schedule kept."""
+    __slots__ = ("sections", "statistics", "index", "key")
+
+    def __init__(self, sections, statistics, index, key):
+        self.sections = sections
+        self.statistics = statistics
+        self.index = index
+        self.key = key
+
+    def __lt__(self, other):
+        return (self.key, self.index) > (other.key, other.index)
+
+class SearchBudget:
+    """This class limits a search by wall clock time and by the number of search
+    nodes visited, setting exhausted once either limit is reached."""
+    def __init__(self, time_limit=None, node_limit=None):
+        self.deadline = None
+        if time_limit is not None:
+            self.deadline = time.time() + time_limit
+        self.node_limit = node_limit
+        self.nodes = 0
+        self.exhausted = False
+
+    def spend(self):
+        """Counts a search node. Returns False once the budget is exhausted."""
+        self.nodes += 1
+        if self.node_limit is not None and self.nodes > self.node_limit:
+            self.exhausted = True
+        # The clock is read on the first node, so that a search started after
+        # the deadline stops right away, and then once every interval
+        elif self.deadline is not None and \
+             self.nodes % TIME_CHECK_INTERVAL == 1 and time.time() > self.deadline:
+            self.exhausted = True
+        return not self.exhausted
+
+    def split(self, share):
+        """Returns a SearchBudget allowing the given share of the time and nodes
+        left in this one. The caller adds its nodes back once it is spent."""
+        part = SearchBudget()
+        if self.deadline is not None:
+            now = time.time()
+            part.deadline = now + share * max(0, self.deadline - now)
+        if self.node_limit is not None:
+            part.node_limit = int(share * max(0, self.node_limit - self.nodes))
+        return part
+
+class SearchStats:
+    """This class records the work a search did and the seconds spent in each
+    phase, so that slow requests can be explained."""
+    def __init__(self):
+        self.engine = None
+        # How a cached search was answered: "hit", "rerank" or "miss"
+        self.cache = None
+        self.group_combinations = 0
+        self.groups_rejected = 0
+        self.nodes = 0
+        self.conflict_checks = 0
+        self.pruned = 0
+        self.leaves = 0
+        self.schedules = 0
+        self.phase_times = {}
+
+    def add_time(self, phase, start):
+        """Adds the time since start, as given by time.time(), to a phase."""
+        self.phase_times[phase] = self.phase_times.get(phase, 0) + time.time() - start
+
+    def merge(self, other):
+        """Adds the counts and times of another SearchStats to this one."""
+        for name in STATS_COUNTER_NAMES:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for phase, seconds in other.phase_times.items():
+            self.phase_times[phase] = self.phase_times.get(phase, 0) + seconds
+
+    def to_dict(self):
+        """Returns the statistics as a dictionary that can be encoded as JSON."""
+        result = dict((name, getattr(self, name)) for name in STATS_COUNTER_NAMES)
+        result["engine"] = self.engine
+        result["cache"] = self.cache
+        result["phase_times"] = dict(self.phase_times)
+        return result
+
+class ScheduleConstraints:
+    """This class holds hard constraints on schedules: blocked time windows, the
+    earliest start and latest end, days to keep free and the most days of class
+    a week. TBA sections satisfy every constraint."""
+    def __init__(self, blocked=(), earliest_time=None, latest_time=None,
+                 free_days="", max_days=None):
+        self.blocked = tuple((tuple(days), start_time, end_time)
+                             for days, start_time, end_time in blocked)
+        self.earliest_time = earliest_time
+        self.latest_time = latest_time
+        self.free_days = "".join(day for day in DAYS if day in free_days)
+        self.max_days = max_days
+        self.forbidden_mask = get_time_mask(self.free_days, 0, 24)
+        for days, start_time, end_time in self.blocked:
+            self.forbidden_mask |= get_time_mask(days, start_time, end_time)
+        if earliest_time is not None:
+            self.forbidden_mask |= get_time_mask(DAYS, 0, earliest_time)
+        if latest_time is not None:
+            self.forbidden_mask |= get_time_mask(DAYS, latest_time, 24)
+
+    def allows(self, section):
+        """Returns True if a section can be part of a schedule meeting the
+        constraints."""
+        if get_section_mask(section) & self.forbidden_mask:
+            return False
+        return self.max_days is None or \
+               count_bits(get_days_mask(section)) <= self.max_days
+
+    def describe(self):
+        """Returns a hashable description of the constraints, equal for two
+        ScheduleConstraints objects that allow the same schedules."""
+        return (self.blocked, self.earliest_time, self.latest_time, self.free_days,
+                self.max_days)
+
+class BoundedScheduleHeap:
+    """This class keeps copies of the best top_k schedules appended to it,
+    ranked by the given key function, where smaller is better. If top_k is None,
+    every schedule is kept, in a CompactScheduleList."""
+    def __init__(self, top_k, key):
+        self.top_k = top_k
+        self.key = key
+        self.heap = []
+        self.count = 0
+        # Without a limit, the schedules and the order of each are stored
+        # compactly, and keys are only computed when the heap is read
+        if top_k is None:
+            self.schedule_list = CompactScheduleList()
+            self.orders = []
+
+    def append(self, schedule_object, order=None):
+        """Offers a schedule to the heap, with order breaking ties between
+        equally ranked schedules. Returns True if the schedule was kept."""
+        if order is None:
+            order = self.count
+        self.count += 1
+        if self.top_k is None:
+            self.schedule_list.append(schedule_object)
+            self.orders.append(order)
+            return True
+        key = self.key(schedule_object)
+        if len(self.heap) >= self.top_k and \
+           not (self.heap and (key, order) < (self.heap[0].key, self.heap[0].index)):
+            return False
+        entry = RankedSchedule(tuple(schedule_object.schedule),
+                               get_statistics(schedule_object), order, key)
+        if len(self.heap) < self.top_k:
+            heapq.heappush(self.heap, entry)
+        else:
+            heapq.heapreplace(self.heap, entry)
+        return True
+
+    def is_full(self):
+        """Returns True if a new schedule must beat the worst schedule kept."""
+        return self.top_k is not None and len(self.heap) >= self.top_k
+
+    def entries(self):
+        """Returns (key, order, schedule_object) for every schedule kept, in
+        no particular order."""
+        if self.top_k is None:
+            entries = []
+            for index, order in enumerate(self.orders):
+                schedule_object = self.schedule_list.get(index)
+                entries.append((self.key(schedule_object), order, schedule_object))
+            return entries
+        return [(entry.key, entry.index, build_schedule(entry.sections, entry.statistics))
+                for entry in self.heap]
+
+    def schedules(self):
+        """Returns the schedules kept, ordered from best to worst."""
+        if self.top_k is None:
+            # Keys are computed on a scratch object, and Schedule objects are
+            # only built once the schedules are sorted
+            schedule_list = self.schedule_list
+            scratch = Schedule(None)
+            def get_key(index):
+                scratch.schedule = schedule_list.get_sections(index)
+                schedule_list.fill(scratch, index)
+                return self.key(scratch), self.orders[index]
+            return [schedule_list.get(index)
+                    for index in sorted(range(len(schedule_list)), key=get_key)]
+        return [schedule_object for key, order, schedule_object in
+                sorted(self.entries(), key=lambda entry: entry[:2])]
+
+# The statistics stored for every schedule
+STATISTIC_NAMES = ("earliest_time", "latest_time", "average_start",
+                   "average_end", "gap_count", "days_of_class", "tba_count")
+
+class CompactScheduleList:
+    """This class stores a list of schedules compactly, as section IDs and
+    packed statistics. Schedule objects are only built by get."""
+    def __init__(self, schedule_list=()):
+        # The sections of the stored schedules, indexed by ID, and the ID of
+        # each section by identity
+        self.sections = []
+        self.section_ids = {}
+        # The section IDs of schedule i are ids[offsets[i]:offsets[i + 1]]
+        self.ids = array.array("i")
+        self.offsets = array.array("l", [0])
+        # The statistics of schedule i, in the order of STATISTIC_NAMES, are
+        # statistics[7 * i:7 * i + 7], and bit j of int_flags[i] is set if
+        # statistic j is an int, since averages of int times are truncated ints
+        self.statistics = array.array("d")
+        self.int_flags = array.array("B")
+        for schedule_object in schedule_list:
+            self.append(schedule_object)
+
+    def append(self, schedule_object):
+        """Stores a schedule at the end of the list."""
+        section_ids = self.section_ids
+        for section in schedule_object.schedule:
+            if id(section) not in section_ids:
+                section_ids[id(section)] = len(self.sections)
+                self.sections.append(section)
+        self.ids.extend([section_ids[id(section)] for section in schedule_object.schedule])
+        self.offsets.append(len(self.ids))
+        statistics = get_statistics(schedule_object)
+        self.statistics.extend(statistics)
+        self.int_flags.append(sum([1 << index for index, value in enumerate(statistics)
+                                   if isinstance(value, (int, long))]))
+
+    def __len__(self):
+        return len(self.int_flags)
+
+    def get_statistics(self, index):
+        """Returns the statistics of the schedule at the given index, as
+        get_statistics would."""
+        flags = self.int_flags[index]
+        start = len(STATISTIC_NAMES) * index
+        values = self.statistics[start:start + len(STATISTIC_NAMES)].tolist()
+        for offset in range(len(values)):
+            if flags & (1 << offset):
+                values[offset] = int(values[offset])
+        return tuple(values)
+
+    def fill(self, schedule_object, index):
+        """Stores the statistics of the schedule at the given index in a
+        schedule object, without its sections."""
+        (schedule_object.earliest_time, schedule_object.latest_time,
+         schedule_object.average_start, schedule_object.average_end,
+         schedule_object.gap_count, schedule_object.days_of_class,
+         schedule_object.tba_count) = self.get_statistics(index)
+
+    def get_sections(self, index):
+        """Returns the sections of the schedule at the given index."""
+        sections = self.sections
+        return tuple([sections[section_id] for section_id
+                      in self.ids[self.offsets[index]:self.offsets[index + 1]]])
+
+    def get(self, index):
+        """Returns the schedule at the given index as a Schedule object."""
+        return build_schedule(self.get_sections(index), self.get_statistics(index))
+
+def get_statistics(schedule_object):
+    """Returns the statistics of a schedule object, in the order of
+    STATISTIC_NAMES."""
+    return (schedule_object.earliest_time, schedule_object.latest_time,
+            schedule_object.average_start, schedule_object.average_end,
+            schedule_object.gap_count, schedule_object.days_of_class,
+            schedule_object.tba_count)
+
+def build_schedule(sections, statistics):
+    """Returns a Schedule object holding the given sections and the statistics
+    returned by get_statistics."""
+    schedule_object = Schedule(sections)
+    (schedule_object.earliest_time, schedule_object.latest_time,
+     schedule_object.average_start, schedule_object.average_end,
+     schedule_object.gap_count, schedule_object.days_of_class,
+     schedule_object.tba_count) = statistics
+    return schedule_object
 
 def compute_statistics(schedule_object):
     """This method takes in a schedule object that already has a list of sections 
@@ -22,22 +332,28 @@ def compute_statistics(schedule_object):
     # The earliest and latest times any section in a schedule will start or end
     earliest_time, latest_time = 24, 0
 
-    # Average start and end times for the entire schedule
+    # Average start and end times for the entire schedule, summed in minutes
     average_start = average_end = 0
+    total_start = total_end = 0
 
-    # Make a list of all the meetings in a schedule
+    # Make a list of all the meetings in a schedule, skipping TBA sections
     meetings = [meeting for section in schedule_object.schedule
+                if section.meetings is not None
                 for meeting in section.meetings]
 
     # Calculate start and end time statistics
     for meeting in meetings:
         earliest_time = min(earliest_time, meeting.start_time)
         latest_time = max(latest_time, meeting.end_time)
-        average_start += meeting.start_time
-        average_end += meeting.end_time
-        
-    average_start = average_start / len(meetings)
-    average_end = average_end / len(meetings)
+        total_start += to_minutes(meeting.start_time)
+        total_end += to_minutes(meeting.end_time)
+
+    # A schedule without any meetings keeps averages of 0
+    if meetings:
+        average_start = get_average_time(total_start, len(meetings), all(
+            isinstance(meeting.start_time, (int, long)) for meeting in meetings))
+        average_end = get_average_time(total_end, len(meetings), all(
+            isinstance(meeting.end_time, (int, long)) for meeting in meetings))
 
     # How many hours are empty between classes in the same day
     gap_count = 0
@@ -56,9 +372,12 @@ def compute_statistics(schedule_object):
         if not day_classes:
             days_of_class += -1
             continue
-        # Add in each time gap between two classes in a day
+        # Add in each time gap between two classes in a day. The day's total
+        # is added separately so that the sum matches ScheduleStatistics
+        day_gap = 0
         for i in range(len(day_classes)-1):
-            gap_count += day_classes[i+1][0] - day_classes[i][1]
+            day_gap += day_classes[i+1][0] - day_classes[i][1]
+        gap_count += day_gap
 
     # Store the calculated values in the schedule object
     schedule_object.earliest_time = earliest_time
@@ -67,86 +386,1049 @@ def compute_statistics(schedule_object):
     schedule_object.average_end = average_end
     schedule_object.gap_count = gap_count
     schedule_object.days_of_class = days_of_class
+    schedule_object.tba_count = len([section for section in schedule_object.schedule
+                                     if section.meetings is None])
 
-def find_schedules(course_list, section_list, primary_compare, secondary_compare):
-    """Returns an ordered list of schedules, where schedules are lists of sections
-    given two ordering preferences"""
-    
-    schedule_list = []
+def to_minutes(hours):
+    """Returns a time in hours as a whole number of minutes."""
+    return int(round(hours * MINUTES_PER_HOUR))
 
-    # TODO: handle the case in which len(course_list) == 0
-    # This will become necessary when we allow users to request specific sections
+def get_average_time(total_minutes, count, whole_hours):
+    """Returns the average in hours of count times adding up to total_minutes.
+    Averages of times stored as whole hours are truncated, as the division of
+    ints always has been."""
+    if whole_hours:
+        return total_minutes // MINUTES_PER_HOUR // count
+    return float(total_minutes) / (MINUTES_PER_HOUR * count)
 
-    # Recursively generates all possible schedules given the input courses
-    for group_list in generate_group_lists(course_list):
-        section_lists = []
-        for group in group_list:
-            for section_list in group.sections.values():
-                section_lists.append(section_list)
-        schedule_list.extend(find_schedules_from_section_lists(section_lists))
+class ScheduleStatistics:
+    """This class maintains the statistics of a schedule while the search adds
+    and removes its sections one at a time."""
+    def __init__(self):
+        self.earliest_time = 24
+        self.latest_time = 0
+        self.meeting_count = 0
+        # The start and end times in minutes, and how many of them are floats
+        self.total_start = 0
+        self.total_end = 0
+        self.float_starts = 0
+        self.float_ends = 0
+        # Sorted (start, end) intervals and total gap hours for each day
+        self.day_classes = dict((day, []) for day in DAYS)
+        self.day_gaps = dict((day, 0) for day in DAYS)
+        self.days_of_class = 0
+        # Bitmask with bit i set if there are classes on DAYS[i]
+        self.days_mask = 0
+        # The number of sections whose meeting information is TBA
+        self.tba_count = 0
+        # The values overwritten by each push, so that pop can restore them
+        # exactly instead of undoing floating point arithmetic
+        self.history = []
+
+    def push(self, section):
+        """Adds the meetings of a section to the statistics."""
+        added_classes = []
+        changed_day_gaps = {}
+        self.history.append((self.earliest_time, self.latest_time,
+                             self.meeting_count, self.total_start, self.total_end,
+                             self.float_starts, self.float_ends,
+                             self.days_of_class, self.days_mask, self.tba_count,
+                             added_classes, changed_day_gaps))
+        if section.meetings is None:
+            self.tba_count += 1
+            return
+        for meeting in section.meetings:
+            self.earliest_time = min(self.earliest_time, meeting.start_time)
+            self.latest_time = max(self.latest_time, meeting.end_time)
+            self.total_start += to_minutes(meeting.start_time)
+            self.total_end += to_minutes(meeting.end_time)
+            self.float_starts += not isinstance(meeting.start_time, (int, long))
+            self.float_ends += not isinstance(meeting.end_time, (int, long))
+            self.meeting_count += 1
+            for day_index, day in enumerate(DAYS):
+                if day not in meeting.days:
+                    continue
+                interval = (meeting.start_time, meeting.end_time)
+                bisect.insort(self.day_classes[day], interval)
+                added_classes.append((day, interval))
+                if day not in changed_day_gaps:
+                    changed_day_gaps[day] = self.day_gaps[day]
+                if not self.days_mask & (1 << day_index):
+                    self.days_mask |= 1 << day_index
+                    self.days_of_class += 1
+        # Only the days the section meets on need their gaps recomputed
+        for day in changed_day_gaps:
+            self.day_gaps[day] = self.compute_day_gap(day)
+
+    def pop(self):
+        """Removes the meetings of the most recently pushed section."""
+        (self.earliest_time, self.latest_time, self.meeting_count,
+         self.total_start, self.total_end, self.float_starts, self.float_ends,
+         self.days_of_class, self.days_mask, self.tba_count,
+         added_classes, changed_day_gaps) = self.history.pop()
+        for day, interval in added_classes:
+            self.day_classes[day].remove(interval)
+        self.day_gaps.update(changed_day_gaps)
+
+    def compute_day_gap(self, day):
+        """Returns the hours between consecutive classes on the given day."""
+        day_classes = self.day_classes[day]
+        gap = 0
+        for i in range(len(day_classes)-1):
+            gap += day_classes[i+1][0] - day_classes[i][1]
+        return gap
+
+    def fill(self, schedule_object):
+        """Stores the statistics of the current schedule in a schedule object,
+        the same way compute_statistics would."""
+        schedule_object.earliest_time = self.earliest_time
+        schedule_object.latest_time = self.latest_time
+        # The object may be reused, so a schedule without meetings must still
+        # reset its averages to 0
+        schedule_object.average_start = schedule_object.average_end = 0
+        if self.meeting_count:
+            schedule_object.average_start = get_average_time(
+                self.total_start, self.meeting_count, not self.float_starts)
+            schedule_object.average_end = get_average_time(
+                self.total_end, self.meeting_count, not self.float_ends)
+        gap_count = 0
+        for day in DAYS:
+            gap_count += self.day_gaps[day]
+        schedule_object.gap_count = gap_count
+        schedule_object.days_of_class = self.days_of_class
+        schedule_object.tba_count = self.tba_count
+
+class RemainingBounds:
+    """This class summarizes section lists that remain to be searched."""
+    def __init__(self):
+        # The earliest end time and latest start time of any remaining meeting
+        self.min_end = None
+        self.max_start = None
+        # The most that the remaining section lists can shrink the gaps of each
+        # day, which is at most the class time they add to it
+        self.day_capacity = dict((day, 0) for day in DAYS)
+        # Days on which some section in the search has meetings that overlap
+        # each other, so that the day's gaps may add up to a negative number
+        self.overlapping_days = set()
+
+def is_overlapping(day_classes):
+    """Checks whether any two of a day's sorted (start, end) intervals overlap."""
+    latest_end = None
+    for start, end in day_classes:
+        if latest_end is not None and start < latest_end:
+            return True
+        latest_end = end if latest_end is None else max(latest_end, end)
+    return False
+
+def compute_list_bounds(section_list):
+    """Returns the RemainingBounds summarizing a single section list."""
+    remaining = RemainingBounds()
+    for section in section_list:
+        if section.meetings is None:
+            continue
+        for meeting in section.meetings:
+            if remaining.min_end is None or meeting.end_time < remaining.min_end:
+                remaining.min_end = meeting.end_time
+            if remaining.max_start is None or meeting.start_time > remaining.max_start:
+                remaining.max_start = meeting.start_time
+        # Only one section is picked from the list, so the most the list can
+        # shrink a day's gaps is the most any one of its sections can
+        for day in DAYS:
+            day_classes = sorted([(meeting.start_time, meeting.end_time)
+                                  for meeting in section.meetings
+                                  if day in meeting.days])
+            if not day_classes:
+                continue
+            if is_overlapping(day_classes):
+                remaining.overlapping_days.add(day)
+                capacity = len(day_classes) * max(end - start for start, end in day_classes)
+            else:
+                capacity = sum(end - start for start, end in day_classes)
+            remaining.day_capacity[day] = max(remaining.day_capacity[day], capacity)
+    return remaining
+
+def compute_section_mask(section):
+    """Returns the weekly occupancy bitmask of a section. Sections whose meeting
+    information is TBA occupy no slots and therefore have an empty mask."""
+    mask = 0
+    if section.meetings is None:
+        return mask
+    for meeting in section.meetings:
+        mask |= get_time_mask(meeting.days, meeting.start_time, meeting.end_time)
+    return mask
+
+def get_time_mask(days, start_time, end_time):
+    """Returns the occupancy bitmask of the time between start_time and end_time,
+    in hours, on each of the given days."""
+    # Round outwards to the enclosing 5-minute slots, clamped to the day
+    start_slot = int(math.floor(start_time * SLOTS_PER_HOUR + SLOT_EPSILON))
+    end_slot = int(math.ceil(end_time * SLOTS_PER_HOUR - SLOT_EPSILON))
+    start_slot = max(start_slot, 0)
+    end_slot = min(end_slot, SLOTS_PER_DAY)
+    mask = 0
+    if end_slot <= start_slot:
+        return mask
+    time_bits = ((1 << (end_slot - start_slot)) - 1) << start_slot
+    # Copy the slots into each day
+    for day in days:
+        day_index = DAYS.find(day)
+        if day_index >= 0:
+            mask |= time_bits << (day_index * SLOTS_PER_DAY)
+    return mask
+
+def get_days_mask(section):
+    """Returns a bitmask with bit i set if a section meets on DAYS[i], the same
+    way ScheduleStatistics counts days of class."""
+    days_mask = 0
+    if section.meetings is not None:
+        for meeting in section.meetings:
+            for day_index, day in enumerate(DAYS):
+                if day in meeting.days:
+                    days_mask |= 1 << day_index
+    return days_mask
+
+def count_bits(mask):
+    """Returns the number of bits set in a mask."""
+    return bin(mask).count("1")
+
+def get_section_mask(section):
+    """Returns the occupancy bitmask of a section, computing it if the catalog
+    has not been compiled yet."""
+    mask = getattr(section, "mask", None)
+    if mask is None:
+        mask = section.mask = compute_section_mask(section)
+    return mask
+
+def compile_course_data(course_data):
+    """Precomputes the occupancy bitmask of every section in the catalog and the
+    catalog's ConflictIndex, stored as course_data.conflict_index."""
+    for department in course_data.departments.values():
+        for course in department.courses.values():
+            for group in course.groups:
+                for sections in group.sections.values():
+                    for section in sections:
+                        section.mask = compute_section_mask(section)
+    course_data.conflict_index = ConflictIndex(course_data)
+
+def is_compiled(course_data):
+    """Returns True if compile_course_data has been called on a catalog."""
+    return getattr(course_data, "conflict_index", None) is not None
+
+class ConflictIndex:
+    """This class holds, for each section ID in a catalog, a bitmask of the IDs
+    of the sections it overlaps. TBA sections conflict with nothing."""
+    def __init__(self, course_data):
+        self.sections = []
+        for department_name in sorted(course_data.departments):
+            department = course_data.departments[department_name]
+            for code in sorted(department.courses):
+                for group in department.courses[code].groups:
+                    for section_type in sorted(group.sections):
+                        self.sections.extend(group.sections[section_type])
 
-    schedule_list = sort_schedules(schedule_list, primary_compare, secondary_compare)
+        # The IDs of the sections with each distinct occupancy mask
+        ids_by_mask = {}
+        for section_id, section in enumerate(self.sections):
+            section.section_id = section_id
+            section.conflict_index = self
+            mask = get_section_mask(section)
+            ids_by_mask[mask] = ids_by_mask.get(mask, 0) | (1 << section_id)
+
+        # The IDs of the sections occupying each slot
+        ids_by_slot = {}
+        for mask, ids in ids_by_mask.items():
+            for slot in iter_bits(mask):
+                ids_by_slot[slot] = ids_by_slot.get(slot, 0) | ids
+
+        # A section conflicts with every section sharing one of its slots
+        conflicts_by_mask = {}
+        for mask in ids_by_mask:
+            conflicts = 0
+            for slot in iter_bits(mask):
+                conflicts |= ids_by_slot[slot]
+            conflicts_by_mask[mask] = conflicts
+        self.conflicts = [conflicts_by_mask[get_section_mask(section)]
+                          for section in self.sections]
+
+    def __getstate__(self):
+        """Returns the index to pickle, storing each distinct bitmask of
+        conflicts once, since pickle would copy it for every section."""
+        class_conflicts = []
+        class_indices = {}
+        section_classes = array.array("i")
+        for conflicts in self.conflicts:
+            if id(conflicts) not in class_indices:
+                class_indices[id(conflicts)] = len(class_conflicts)
+                class_conflicts.append(conflicts)
+            section_classes.append(class_indices[id(conflicts)])
+        return {"sections": self.sections, "class_conflicts": class_conflicts,
+                "section_classes": section_classes}
+
+    def __setstate__(self, state):
+        """Restores a pickled index."""
+        self.sections = state["sections"]
+        self.conflicts = [state["class_conflicts"][class_index]
+                          for class_index in state["section_classes"]]
+
+    def get_ids_mask(self, sections):
+        """Returns the bitmask of the IDs of the given sections."""
+        ids = 0
+        for section in sections:
+            ids |= 1 << section.section_id
+        return ids
+
+def iter_bits(mask):
+    """Yields the index of every bit set in a mask, in increasing order."""
+    while mask:
+        low_bit = mask & -mask
+        yield low_bit.bit_length() - 1
+        mask ^= low_bit
+
+def find_schedules(course_list, section_list, primary_compare=None,
+                   secondary_compare=None, top_k=None, ranking=None, budget=None,
+                   engine="dfs", stats=None, constraints=None):
+    """Returns an ordered list of schedules, where schedules are lists of
+    sections given two ordering preferences or a Ranking. engine names one of
+    ENGINES."""
+
+    if ranking is None:
+        ranking = get_comparison_ranking(primary_compare, secondary_compare)
+    if stats is not None:
+        stats.engine = engine
+
+    # The other engines are imported here, since they import this module
+    if engine == "beam":
+        import beam_search
+        schedule_list, bound = beam_search.find_schedules_beam(
+            course_list, section_list, ranking, top_k, budget, constraints, stats)
+        return schedule_list
+    elif engine == "batch":
+        import batch_scorer
+        return batch_scorer.find_schedules_batched(
+            course_list, section_list, top_k=top_k, ranking=ranking, budget=budget,
+            stats=stats, constraints=constraints)
+    elif engine != "dfs":
+        raise ValueError("Unknown engine: %s" % engine)
+
+    # When only the best few schedules are wanted, the heap is bounded instead
+    # of collecting and sorting every schedule
+    schedule_list = BoundedScheduleHeap(top_k, ranking.key)
+
+    # Generates all possible schedules given the input courses and pinned
+    # sections. Courses that only appear through their pinned sections are
+    # scheduled too, so course_list may be empty
+    combinations = iter_section_list_combinations(course_list, section_list, stats,
+                                                  constraints)
+    if stats is not None:
+        combinations = iter_timed(combinations, stats, "groups")
+    for combination_index, section_lists in enumerate(combinations):
+        if stats is not None:
+            stats.group_combinations += 1
+            start = time.time()
+        collect_schedules(section_lists, ranking, schedule_list,
+                          (combination_index,), budget, stats, constraints)
+        if stats is not None:
+            stats.add_time("search", start)
+        if budget is not None and budget.exhausted:
+            break
 
     # Return a sorted list of schedule objects
-    return schedule_list
+    start = time.time()
+    schedules = schedule_list.schedules()
+    if stats is not None:
+        stats.add_time("sort", start)
+    return schedules
+
+def iter_timed(iterable, stats, phase):
+    """Yields the items of an iterable, adding the time spent producing each one
+    to a phase of a SearchStats object."""
+    iterator = iter(iterable)
+    while True:
+        start = time.time()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            stats.add_time(phase, start)
+            return
+        stats.add_time(phase, start)
+        yield item
+
+def estimate_search_size(course_list, section_list=(), constraints=None):
+    """Returns the number of ways of picking a section from every list of every
+    group combination, ignoring conflicts, which bounds the number of
+    schedules the depth first search can visit."""
+    group_options = get_group_options(course_list, section_list, constraints)
+    if group_options is None:
+        return 0
+    size = 1
+    for options in group_options:
+        course_size = 0
+        for section_lists in options:
+            group_size = 1
+            for type_section_list in section_lists:
+                group_size *= len(type_section_list)
+            course_size += group_size
+        size *= course_size
+    return size
+
+def collect_schedules(section_lists, ranking, schedule_list, order_prefix=(),
+                      budget=None, stats=None, constraints=None):
+    """Appends every schedule built from section_lists to a BoundedScheduleHeap,
+    ordering ties by order_prefix followed by the positions of its sections."""
+    pruner = None
+    if schedule_list.top_k is not None and ranking.can_bound():
+        pruner = BranchAndBound(section_lists, ranking, schedule_list, order_prefix)
+    for order, members, schedule_object in search_section_lists(section_lists, pruner,
+                                                                budget, stats,
+                                                                constraints):
+        # Every concrete schedule a search result stands for ranks the same,
+        # and they are expanded in increasing order, so once the heap rejects
+        # one it would reject the rest as well
+        for order, concrete_schedule in expand_schedule(order, members, schedule_object):
+            if stats is not None:
+                stats.schedules += 1
+            if not schedule_list.append(concrete_schedule, order_prefix + order):
+                break
+
+def iter_schedules(course_list, section_list=()):
+    """Yields every possible schedule for the given courses and pinned sections,
+    in the order the search finds them, without holding the rest of the search
+    space in memory. The schedules are not ranked."""
+    for section_lists in iter_section_list_combinations(course_list, section_list):
+        for schedule_object in iter_schedules_from_section_lists(section_lists):
+            yield schedule_object
+
+def count_schedules(course_list, section_list=(), constraints=None, budget=None,
+                    limit=None):
+    """Returns the number of schedules find_schedules would return, without
+    building any of them. The count is a lower bound if the budget or limit
+    stops it."""
+    total = 0
+    for section_lists in iter_section_list_combinations(course_list, section_list,
+                                                        constraints=constraints):
+        combination_limit = None
+        if limit is not None:
+            combination_limit = limit - total
+        total += count_schedules_from_section_lists(section_lists, constraints, budget,
+                                                    combination_limit)
+        if budget is not None and budget.exhausted:
+            break
+        if limit is not None and total > limit:
+            break
+    return total
+
+def count_schedules_from_section_lists(section_lists, constraints=None, budget=None,
+                                       limit=None):
+    """Returns the number of ways of picking one section from each list without
+    conflicts, or a partial count once the SearchBudget is exhausted or the
+    count passes limit."""
+    max_days = None
+    if constraints is not None:
+        max_days = constraints.max_days
+    # The candidates of each list, as (number of sections, mask, days mask)
+    # triples for each equivalence class. Lists with the fewest classes are
+    # picked first
+    class_lists = sorted([[(len(members), get_section_mask(members[0][1]),
+                            get_days_mask(members[0][1]))
+                           for members in get_equivalence_classes(section_list)]
+                          for section_list in section_lists], key=len)
+    # The slots used by any section of each list or of the lists after it
+    remaining_masks = [0] * (len(class_lists) + 1)
+    for index in reversed(range(len(class_lists))):
+        remaining_masks[index] = remaining_masks[index + 1]
+        for size, mask, days_mask in class_lists[index]:
+            remaining_masks[index] |= mask
+    memo = {}
+
+    # Each call stops once its count passes allowance, which is None when the
+    # count is not limited, and then returns the partial count. A call given
+    # what is left of its caller's allowance, divided by the size of the
+    # class it extends, passes it exactly when the caller passes its own.
+    # Partial counts are not memoized
+    def count(index, occupied, allowance):
+        if index == len(class_lists):
+            return 1
+        memo_key = (index, occupied & remaining_masks[index])
+        if memo_key not in memo:
+            total = 0
+            for size, mask, days_mask in class_lists[index]:
+                if budget is not None and not budget.spend():
+                    return total
+                if not mask & occupied:
+                    total += size * count(index + 1, occupied | mask,
+                                          get_allowance(allowance, total, size))
+                    if allowance is not None and total > allowance:
+                        return total
+            if budget is not None and budget.exhausted:
+                return total
+            memo[memo_key] = total
+        return memo[memo_key]
+
+    def count_limiting_days(index, occupied, days, allowance):
+        if index == len(class_lists):
+            return 1
+        memo_key = (index, occupied & remaining_masks[index], days)
+        if memo_key not in memo:
+            total = 0
+            for size, mask, days_mask in class_lists[index]:
+                if budget is not None and not budget.spend():
+                    return total
+                if not mask & occupied and count_bits(days | days_mask) <= max_days:
+                    total += size * count_limiting_days(index + 1, occupied | mask,
+                                                        days | days_mask,
+                                                        get_allowance(allowance, total,
+                                                                      size))
+                    if allowance is not None and total > allowance:
+                        return total
+            if budget is not None and budget.exhausted:
+                return total
+            memo[memo_key] = total
+        return memo[memo_key]
+
+    def get_allowance(allowance, total, size):
+        if allowance is None:
+            return None
+        return (allowance - total) // size
+
+    if max_days is None:
+        return count(0, 0, limit)
+    return count_limiting_days(0, 0, 0, limit)
+
+def has_schedules(course_list, section_list=(), budget=None, constraints=None):
+    """Returns True if there is a schedule for the given courses and pinned
+    sections, False if there is none, or None if the budget ran out first."""
+    for section_lists in iter_section_list_combinations(course_list, section_list,
+                                                        constraints=constraints):
+        for result in search_section_lists(section_lists, None, budget,
+                                           constraints=constraints):
+            return True
+        if budget is not None and budget.exhausted:
+            return None
+    return False
+
+def find_conflicting_subset(course_list, section_list=(), budget=None,
+                            constraints=None, known_infeasible=False):
+    """Returns (courses, sections), a minimal subset of the given courses and
+    pinned sections that has no schedule, or None if they have one."""
+    if not known_infeasible and \
+       has_schedules(course_list, section_list, budget, constraints) is not False:
+        return None
+    courses = list(course_list)
+    sections = list(section_list)
+    for course in list(courses):
+        remaining_courses = [other for other in courses if other is not course]
+        if has_schedules(remaining_courses, sections, budget, constraints) is False:
+            courses = remaining_courses
+    for section in list(sections):
+        remaining_sections = [other for other in sections if other is not section]
+        if has_schedules(courses, remaining_sections, budget, constraints) is False:
+            sections = remaining_sections
+    return courses, sections
+
+def pareto_schedules(course_list, section_list=(), budget=None, constraints=None):
+    """Returns every schedule for the given courses and pinned sections that no
+    other schedule dominates on get_pareto_vector."""
+    front = ParetoFront()
+    for combination_index, section_lists in enumerate(
+            iter_section_list_combinations(course_list, section_list,
+                                           constraints=constraints)):
+        collect_pareto_schedules(section_lists, front, (combination_index,), budget,
+                                 constraints)
+        if budget is not None and budget.exhausted:
+            break
+    return front.schedules()
+
+def collect_pareto_schedules(section_lists, front, order_prefix=(), budget=None,
+                             constraints=None):
+    """Offers every schedule built from section_lists to a ParetoFront, ordering
+    them by order_prefix followed by the positions of the schedule's sections
+    in their lists."""
+    pruner = ParetoPruner(section_lists, front)
+    for order, members, schedule_object in search_section_lists(section_lists, pruner,
+                                                                budget,
+                                                                constraints=constraints):
+        # Every concrete schedule a search result stands for has the same
+        # statistics, so they are either all kept or all dominated
+        for order, concrete_schedule in expand_schedule(order, members, schedule_object):
+            if not front.append(concrete_schedule, order_prefix + order):
+                break
 
 def generate_group_lists(course_list):
     """Picks a group from each class from which to pick sections."""
-    group_lists = []
-    generate_group_lists_helper(0, course_list, [], group_lists)
-    return group_lists
-
-def generate_group_lists_helper(current_course, course_list, current_group_list, group_lists):
-    """Recursive helper function for list generation."""
-    if current_course >= len(course_list):
-        group_lists.append(current_group_list[:])
+    return list(iter_group_lists(course_list))
+
+def iter_group_lists(course_list):
+    """Lazily yields every way of picking a group from each class."""
+    return itertools.product(*[course.groups for course in course_list])
+
+def get_section_lists(group_list):
+    """Returns the lists of sections, one per section type of each group, from
+    which a schedule picks one section each."""
+    section_lists = []
+    for group in group_list:
+        for section_list in group.sections.values():
+            section_lists.append(section_list)
+    return section_lists
+
+def get_pinned_sections(section_list):
+    """Returns (courses, sections_by_course, mask) for a list of pinned
+    sections, or None if they cannot be taken together."""
+    courses = []
+    sections_by_course = {}
+    mask = 0
+    for section in section_list:
+        course = section.group.course
+        sections_by_type = sections_by_course.get(course)
+        if sections_by_type is None:
+            sections_by_type = sections_by_course[course] = {}
+            courses.append(course)
+        # The same section may be pinned more than once
+        if sections_by_type.get(section.type) is section:
+            continue
+        if section.type in sections_by_type:
+            return None
+        if any(pinned.group is not section.group for pinned in sections_by_type.values()):
+            return None
+        section_mask = get_section_mask(section)
+        if section_mask & mask:
+            return None
+        sections_by_type[section.type] = section
+        mask |= section_mask
+    return courses, sections_by_course, mask
+
+def filter_section_list(section_list, pinned_mask, constraints=None):
+    """Returns the sections of a list that do not conflict with the pinned
+    sections and are allowed by the given ScheduleConstraints, or the list
+    itself if nothing is pinned or constrained."""
+    if not pinned_mask and constraints is None:
+        return section_list
+    return [section for section in section_list
+            if not get_section_mask(section) & pinned_mask and
+            (constraints is None or constraints.allows(section))]
+
+def get_group_options(course_list, section_list=(), constraints=None):
+    """Returns, for each course to schedule, the section lists of each of its
+    groups that can be taken alongside the pinned sections, or None if none."""
+    pinned = get_pinned_sections(section_list)
+    if pinned is None:
+        return None
+    pinned_courses, pinned_by_course, pinned_mask = pinned
+    if constraints is not None and \
+       not all(constraints.allows(section) for section in section_list):
+        return None
+
+    course_order = list(course_list)
+    for course in pinned_courses:
+        if course not in course_order:
+            course_order.append(course)
+
+    group_options = []
+    for course in course_order:
+        sections_by_type = pinned_by_course.get(course)
+        if sections_by_type is None:
+            groups = course.groups
+        else:
+            groups = [sections_by_type.values()[0].group]
+        options = []
+        for group in groups:
+            section_lists = []
+            for section_type, type_section_list in group.sections.items():
+                if sections_by_type and section_type in sections_by_type:
+                    section_lists.append([sections_by_type[section_type]])
+                else:
+                    section_lists.append(filter_section_list(type_section_list,
+                                                             pinned_mask, constraints))
+            if all(section_lists):
+                options.append(section_lists)
+        group_options.append(options)
+    return group_options
+
+def iter_section_list_combinations(course_list, section_list=(), stats=None,
+                                   constraints=None):
+    """Lazily yields the section lists of every way of picking a group from each
+    course, skipping groups that cannot fit alongside those already picked."""
+    group_options = get_group_options(course_list, section_list, constraints)
+    if group_options is None:
         return
-    for group in course_list[current_course].groups:
-        current_group_list.append(group)
-        generate_group_lists_helper(current_course + 1, course_list, current_group_list, group_lists)
-        current_group_list.pop()
+    # Whether pairs of section lists, keyed by identity, have any pair of
+    # sections that do not conflict
+    compatible_pairs = {}
+    for section_lists, required in iter_compatible_groups(group_options, 0, [], 0,
+                                                          compatible_pairs, stats):
+        yield section_lists
+
+def iter_compatible_groups(group_options, course_index, section_lists, required,
+                           compatible_pairs, stats=None):
+    """Yields (section_lists, required) for every way of extending the section
+    lists picked so far with a group from each remaining course."""
+    if course_index == len(group_options):
+        yield section_lists, required
+        return
+    for group_section_lists in group_options[course_index]:
+        new_section_lists = section_lists
+        new_required = required
+        for section_list in group_section_lists:
+            new_required = add_section_list(new_section_lists, new_required,
+                                            section_list, compatible_pairs)
+            if new_required is None:
+                if stats is not None:
+                    stats.groups_rejected += 1
+                break
+            new_section_lists = new_section_lists + [section_list]
+        else:
+            for combination in iter_compatible_groups(group_options, course_index + 1,
+                                                      new_section_lists, new_required,
+                                                      compatible_pairs, stats):
+                yield combination
+
+def get_required_mask(section_list):
+    """Returns the slots occupied by every section of a list, which a schedule
+    picking a section from the list is sure to occupy."""
+    required = None
+    for section in section_list:
+        if required is None:
+            required = get_section_mask(section)
+        else:
+            required &= get_section_mask(section)
+    return required or 0
+
+def add_section_list(section_lists, required, section_list, compatible_pairs):
+    """Returns the slots that any schedule picking from section_lists and
+    section_list must occupy, or None if section_list cannot fit."""
+    list_required = get_required_mask(section_list)
+    if list_required & required:
+        return None
+    if all(get_section_mask(section) & required for section in section_list):
+        return None
+    for other_section_list in section_lists:
+        pair_key = (id(other_section_list), id(section_list))
+        if pair_key not in compatible_pairs:
+            compatible_pairs[pair_key] = is_compatible(other_section_list, section_list)
+        if not compatible_pairs[pair_key]:
+            return None
+    return required | list_required
+
+def is_compatible(section_list1, section_list2):
+    """Returns True if some section of one list does not conflict with some
+    section of the other."""
+    conflict_index = getattr(section_list1[0], "conflict_index", None)
+    if conflict_index is not None and \
+       getattr(section_list2[0], "conflict_index", None) is conflict_index:
+        ids = conflict_index.get_ids_mask(section_list2)
+        return any(ids & ~conflict_index.conflicts[section.section_id]
+                   for section in section_list1)
+    masks = set(get_section_mask(section) for section in section_list2)
+    return any(not get_section_mask(section) & mask
+               for section in section_list1 for mask in masks)
 
 def find_schedules_from_section_lists(section_lists):
     """Finds schedules from lists of sections."""
-    schedule_list = []
-    find_schedules_from_section_lists_helper(0, section_lists, [], schedule_list)
-    return schedule_list
-
-def find_schedules_from_section_lists_helper(current_section_list, section_lists, current_schedule, schedule_list):
-    """Recursive helper function for scheduler generation."""
-    if current_section_list == len(section_lists):
-        schedule_object = Schedule(current_schedule[:])
-        compute_statistics(schedule_object)
-        schedule_list.append(schedule_object)
+    return list(iter_schedules_from_section_lists(section_lists))
+
+def iter_schedules_from_section_lists(section_lists, pruner=None):
+    """Yields schedules from lists of sections as the search finds them."""
+    for order, members, schedule_object in search_section_lists(section_lists, pruner):
+        for order, concrete_schedule in expand_schedule(order, members, schedule_object):
+            yield build_schedule(concrete_schedule.schedule,
+                                 get_statistics(concrete_schedule))
+
+def get_meeting_pattern(section):
+    """Returns a key that is equal for two sections exactly when they have the
+    same meetings, in the same order."""
+    if section.meetings is None:
+        return None
+    return tuple((tuple(meeting.days), meeting.start_time, meeting.end_time,
+                  isinstance(meeting.start_time, float),
+                  isinstance(meeting.end_time, float))
+                 for meeting in section.meetings)
+
+def get_equivalence_classes(section_list):
+    """Groups the sections of a list by meeting pattern. Returns a list of
+    classes in order of their first section, where each class is a list of
+    (position, section) pairs in increasing position order."""
+    classes = []
+    classes_by_pattern = {}
+    for position, section in enumerate(section_list):
+        pattern = get_meeting_pattern(section)
+        if pattern not in classes_by_pattern:
+            classes_by_pattern[pattern] = []
+            classes.append(classes_by_pattern[pattern])
+        classes_by_pattern[pattern].append((position, section))
+    return classes
+
+def expand_schedule(order, members, schedule_object):
+    """Yields (order, schedule_object) for every concrete schedule that a search
+    result stands for, in increasing order, reusing one object."""
+    if all(len(class_members) == 1 for class_members in members):
+        yield order, schedule_object
+        return
+    for choice in itertools.product(*members):
+        schedule_object.schedule = tuple(section for position, section in choice)
+        yield tuple(position for position, section in choice), schedule_object
+
+def merge_list_bounds(list_bounds_list):
+    """Returns the RemainingBounds summarizing several lists, given the
+    RemainingBounds of each list as computed by compute_list_bounds."""
+    remaining = RemainingBounds()
+    for list_bounds in list_bounds_list:
+        if list_bounds.min_end is not None:
+            remaining.min_end = min(list_bounds.min_end, remaining.min_end) \
+                if remaining.min_end is not None else list_bounds.min_end
+        if list_bounds.max_start is not None:
+            remaining.max_start = max(list_bounds.max_start, remaining.max_start) \
+                if remaining.max_start is not None else list_bounds.max_start
+        for day in DAYS:
+            remaining.day_capacity[day] += list_bounds.day_capacity[day]
+        remaining.overlapping_days |= list_bounds.overlapping_days
+    return remaining
+
+class BranchAndBound:
+    """This class decides whether a partial schedule can be pruned because no
+    completion can beat the worst schedule kept in a full
+    BoundedScheduleHeap."""
+    def __init__(self, section_lists, ranking, schedule_heap, order_prefix=()):
+        self.ranking = ranking
+        self.schedule_heap = schedule_heap
+        self.order_prefix = order_prefix
+        self.list_bounds = [compute_list_bounds(section_list)
+                            for section_list in section_lists]
+        # Summarize every list. The earliest end and latest start times are
+        # kept for the whole search, which is still a valid bound
+        self.remaining = merge_list_bounds(self.list_bounds)
+        # The day capacities overwritten by each assignment
+        self.history = []
+
+    def assign(self, list_index):
+        """Removes a section list from the remaining lists."""
+        day_capacity = self.remaining.day_capacity
+        self.history.append(dict(day_capacity))
+        list_capacity = self.list_bounds[list_index].day_capacity
+        for day in DAYS:
+            day_capacity[day] -= list_capacity[day]
+
+    def unassign(self):
+        """Returns the most recently assigned section list to the remaining
+        lists."""
+        self.remaining.day_capacity = self.history.pop()
+
+    def can_prune(self, partial, positions, domains):
+        """Returns True if the subtree below a partial schedule can be
+        skipped."""
+        schedule_heap = self.schedule_heap
+        if not schedule_heap.is_full():
+            return False
+        if not schedule_heap.heap:
+            return True
+        worst = schedule_heap.heap[0]
+        bound_key = self.ranking.bound_key(partial, self.remaining)
+        if bound_key != worst.key:
+            return bound_key > worst.key
+        # The bound ties with the worst schedule kept, so the subtree can only
+        # improve on it if one of its schedules wins the tie by coming first
+        first_order = tuple(position if position is not None else domain[0][0]
+                            for position, domain in zip(positions, domains))
+        return self.order_prefix + first_order > worst.index
+
+def get_pareto_vector(schedule_object):
+    """Returns the statistics pareto_schedules compares schedules on, each of
+    which is better when smaller."""
+    return (schedule_object.tba_count,
+            -schedule_object.earliest_time, schedule_object.latest_time,
+            schedule_object.latest_time - schedule_object.earliest_time,
+            schedule_object.gap_count, schedule_object.days_of_class)
+
+def dominates(vector1, vector2):
+    """Returns True if vector1 is at least as good as vector2 everywhere and
+    better somewhere, where smaller is better."""
+    return vector1 != vector2 and \
+        all(value1 <= value2 for value1, value2 in zip(vector1, vector2))
+
+class ParetoFront:
+    """This class keeps the schedules appended to it that are not dominated by
+    any other schedule appended to it."""
+    def __init__(self):
+        # (vector, order, schedule_object) for each schedule kept
+        self.entries = []
+
+    def append(self, schedule_object, order):
+        """Offers a schedule to the front, removing the schedules it dominates.
+        Returns True if the schedule was kept."""
+        vector = get_pareto_vector(schedule_object)
+        if self.dominates(vector):
+            return False
+        self.entries = [entry for entry in self.entries
+                        if not dominates(vector, entry[0])]
+        self.entries.append((vector, order,
+                             build_schedule(tuple(schedule_object.schedule),
+                                            get_statistics(schedule_object))))
+        return True
+
+    def dominates(self, vector):
+        """Returns True if some schedule kept dominates the given vector."""
+        for entry in self.entries:
+            if dominates(entry[0], vector):
+                return True
+        return False
+
+    def schedules(self):
+        """Returns the schedules kept, in order."""
+        return [schedule_object for vector, order, schedule_object
+                in sorted(self.entries, key=lambda entry: entry[1])]
+
+class ParetoPruner(BranchAndBound):
+    """This class decides whether a partial schedule can be pruned because every
+    schedule extending it would be dominated by a schedule in a ParetoFront."""
+    def __init__(self, section_lists, front):
+        BranchAndBound.__init__(self, section_lists, None, None)
+        self.front = front
+
+    def can_prune(self, partial, positions, domains):
+        """Returns True if the subtree below a partial schedule can be
+        skipped."""
+        if not self.front.entries:
+            return False
+        bound = Schedule(None)
+        bound.tba_count = partial.tba_count
+        bound_compact(bound, partial, self.remaining)
+        bound_gaps(bound, partial, self.remaining)
+        bound_days(bound, partial, self.remaining)
+        return self.front.dominates(get_pareto_vector(bound))
+
+def search_section_lists(section_lists, pruner=None, budget=None, stats=None,
+                         constraints=None):
+    """Yields (order, members, schedule_object) for every schedule built by
+    picking one section from each list, searching sections with identical
+    meetings once. The same schedule object is yielded each time."""
+    max_days = None
+    if constraints is not None:
+        max_days = constraints.max_days
+    statistics = ScheduleStatistics()
+    schedule_object = Schedule(None)
+    list_count = len(section_lists)
+    if not list_count:
+        schedule_object.schedule = ()
+        statistics.fill(schedule_object)
+        if stats is not None:
+            stats.leaves += 1
+        yield (), [], schedule_object
+        return
+
+    # The candidates of each list are its equivalence classes, as (position,
+    # section, mask) triples for the first section of each class
+    class_members = []
+    domains = []
+    for section_list in section_lists:
+        classes = get_equivalence_classes(section_list)
+        class_members.append(dict((members[0][0], members) for members in classes))
+        domains.append([(members[0][0], members[0][1], get_section_mask(members[0][1]))
+                        for members in classes])
+    if not all(domains):
+        return
+
+    # The position and section picked from each list, or None if unassigned
+    positions = [None] * list_count
+    chosen = [None] * list_count
+    if pruner is not None and pruner.can_prune(statistics, positions, domains):
+        if stats is not None:
+            stats.pruned += 1
         return
-    for section in section_lists[current_section_list]:
-        if can_add_section(section, current_schedule):
-            current_schedule.append(section)
-            find_schedules_from_section_lists_helper(current_section_list + 1, 
-                                                     section_lists, 
-                                                     current_schedule, 
-                                                     schedule_list)
-            current_schedule.pop()
+
+    # Each frame of the stack holds the list being assigned and an iterator
+    # over its candidates, and domains_stack[i] holds the candidates available
+    # to frame i. Every candidate in a frame's domain is consistent with the
+    # sections already placed
+    list_index = choose_section_list(domains, positions)
+    stack = [(list_index, iter(domains[list_index]))]
+    domains_stack = [domains]
+
+    while stack:
+        list_index, candidates = stack[-1]
+        domains = domains_stack[-1]
+        for position, section, mask in candidates:
+            if budget is not None and not budget.spend():
+                return
+            if stats is not None:
+                stats.nodes += 1
+            # Filter the candidates of the unassigned lists against the section,
+            # abandoning it if any list runs out of candidates
+            new_domains = list(domains)
+            for other_index in range(list_count):
+                if positions[other_index] is not None or other_index == list_index:
+                    continue
+                if stats is not None:
+                    stats.conflict_checks += len(domains[other_index])
+                domain = [candidate for candidate in domains[other_index]
+                          if not candidate[2] & mask]
+                if not domain:
+                    break
+                new_domains[other_index] = domain
+            else:
+                positions[list_index] = position
+                chosen[list_index] = section
+                statistics.push(section)
+                if pruner is not None:
+                    pruner.assign(list_index)
+                if max_days is not None and statistics.days_of_class > max_days:
+                    unassign(list_index, positions, chosen, statistics, pruner)
+                    continue
+                # A section was picked from every list, so the schedule is complete
+                if len(stack) == list_count:
+                    schedule_object.schedule = tuple(chosen)
+                    statistics.fill(schedule_object)
+                    order = tuple(positions)
+                    members = [class_members[index][position]
+                               for index, position in enumerate(positions)]
+                    unassign(list_index, positions, chosen, statistics, pruner)
+                    if stats is not None:
+                        stats.leaves += 1
+                    yield order, members, schedule_object
+                    continue
+                if pruner is not None and \
+                   pruner.can_prune(statistics, positions, new_domains):
+                    unassign(list_index, positions, chosen, statistics, pruner)
+                    if stats is not None:
+                        stats.pruned += 1
+                    continue
+                # Descend into the most constrained remaining list
+                next_index = choose_section_list(new_domains, positions)
+                stack.append((next_index, iter(new_domains[next_index])))
+                domains_stack.append(new_domains)
+                break
+        else:
+            # Every candidate in this list has been tried, so backtrack
+            stack.pop()
+            if stack:
+                domains_stack.pop()
+                unassign(stack[-1][0], positions, chosen, statistics, pruner)
+
+def choose_section_list(domains, positions):
+    """Returns the index of the unassigned list with the fewest candidates,
+    preferring earlier lists in case of a tie."""
+    best_index = None
+    for index, domain in enumerate(domains):
+        if positions[index] is None and \
+           (best_index is None or len(domain) < len(domains[best_index])):
+            best_index = index
+    return best_index
+
+def unassign(list_index, positions, chosen, statistics, pruner):
+    """Undoes the placement of a section from the given list."""
+    positions[list_index] = None
+    chosen[list_index] = None
+    statistics.pop()
+    if pruner is not None:
+        pruner.unassign()
 
 def has_conflict(section1, section2):
     """Checks for a time overlap between two sections."""
-    if section1.meetings is None or section2.meetings is None:
-        return False
-    for meeting1 in section1.meetings:
-        for meeting2 in section2.meetings:
-            days1, days2 = meeting1.days, meeting2.days
-            if len(set(days1) & set(days2)) == 0:
-                continue
-            start_time1, end_time1  = meeting1.start_time, meeting1.end_time
-            start_time2, end_time2  = meeting2.start_time, meeting2.end_time
-            if (start_time1 < end_time2 and start_time2 < end_time1) or \
-               (start_time2 < end_time1 and start_time1 < end_time2):
-                return True
-    return False
+    return get_section_mask(section1) & get_section_mask(section2) != 0
 
 def can_add_section(new_section, schedule):
     """Determines if new_section can be added to the schedule."""
-    return not any(has_conflict(new_section, section) for section in schedule)
+    occupied = 0
+    for section in schedule:
+        occupied |= get_section_mask(section)
+    return get_section_mask(new_section) & occupied == 0
     
 def compare_early(s1, s2):
     """Compares two section objects to see which one has earlier classes."""
@@ -176,6 +1458,184 @@ def compare_days(s1, s2):
     """Compares two section objects to see which one has fewer days of class."""
     return s1.days_of_class - s2.days_of_class
 
+def bound_average_end(partial, remaining):
+    """Returns a lower bound on the average end time of any completion. The
+    bound is rounded down because compute_statistics truncates the average of
+    schedules whose times are all whole hours."""
+    candidates = []
+    if partial.meeting_count:
+        candidates.append(float(partial.total_end) /
+                          (MINUTES_PER_HOUR * partial.meeting_count))
+    if remaining.min_end is not None:
+        candidates.append(remaining.min_end)
+    return math.floor(min(candidates) - BOUND_EPSILON) if candidates else 0
+
+def bound_average_start(partial, remaining):
+    """Returns an upper bound on the average start time of any completion."""
+    candidates = []
+    if partial.meeting_count:
+        candidates.append(float(partial.total_start) /
+                          (MINUTES_PER_HOUR * partial.meeting_count))
+    if remaining.max_start is not None:
+        candidates.append(remaining.max_start)
+    return max(candidates) + BOUND_EPSILON if candidates else 24
+
+def bound_early(bound, partial, remaining):
+    """Fills in the statistics read by the early criterion with values at least as
+    good as those of any completion of the partial schedule. Adding sections
+    can only make the latest time later."""
+    bound.latest_time = partial.latest_time
+    bound.average_end = bound_average_end(partial, remaining)
+
+def bound_late(bound, partial, remaining):
+    """Fills in the statistics read by the late criterion with values at least as
+    good as those of any completion of the partial schedule. Adding sections
+    can only make the earliest time earlier."""
+    bound.earliest_time = partial.earliest_time
+    bound.average_start = bound_average_start(partial, remaining)
+
+def bound_compact(bound, partial, remaining):
+    """Fills in the statistics read by the compact criterion with values at least as
+    good as those of any completion of the partial schedule. Adding sections
+    can only widen the spread between the earliest and latest times."""
+    bound.earliest_time = partial.earliest_time
+    bound.latest_time = partial.latest_time
+
+def bound_gaps(bound, partial, remaining):
+    """Fills in the statistics read by the gaps criterion with values at least
+    as good as those of any completion of the partial schedule."""
+    gap_count = 0
+    for day in DAYS:
+        day_gap = partial.day_gaps[day] - remaining.day_capacity[day]
+        if day not in remaining.overlapping_days:
+            day_gap = max(0, day_gap)
+        gap_count += day_gap
+    bound.gap_count = gap_count - BOUND_EPSILON
+
+def bound_days(bound, partial, remaining):
+    """Fills in the statistics read by the days criterion with values at least as
+    good as those of any completion of the partial schedule. Adding sections
+    can only add days of class."""
+    bound.days_of_class = partial.days_of_class
+
+def key_early(schedule_object):
+    """Returns a sort key that ranks schedules with earlier classes first, in
+    the same order as compare_early."""
+    return (schedule_object.latest_time, schedule_object.average_end)
+
+def key_late(schedule_object):
+    """Returns a sort key that ranks schedules with later classes first, in the
+    same order as compare_late."""
+    return (-schedule_object.earliest_time, -schedule_object.average_start)
+
+def key_compact(schedule_object):
+    """Returns a sort key that ranks more compact schedules first, in the same
+    order as compare_compact."""
+    return (schedule_object.latest_time - schedule_object.earliest_time,)
+
+def key_gaps(schedule_object):
+    """Returns a sort key that ranks schedules with fewer gaps first, in the
+    same order as compare_gaps."""
+    return (schedule_object.gap_count,)
+
+def key_days(schedule_object):
+    """Returns a sort key that ranks schedules with fewer days of class first,
+    in the same order as compare_days."""
+    return (schedule_object.days_of_class,)
+
+class Criterion:
+    """This class describes one way of ranking schedules: its name, a sort key,
+    the equivalent comparator and an optimistic bound for partial schedules."""
+    def __init__(self, name, key, compare, bound):
+        self.name = name
+        self.key = key
+        self.compare = compare
+        self.bound = bound
+
+# The ranking criteria, by the names used in the schedule API
+CRITERIA = dict((criterion.name, criterion) for criterion in [
+    Criterion("early", key_early, compare_early, bound_early),
+    Criterion("late", key_late, compare_late, bound_late),
+    Criterion("compact", key_compact, compare_compact, bound_compact),
+    Criterion("minGaps", key_gaps, compare_gaps, bound_gaps),
+    Criterion("minDays", key_days, compare_days, bound_days),
+])
+
+# Maps each comparator to its criterion
+COMPARATOR_CRITERIA = dict((criterion.compare, criterion)
+                           for criterion in CRITERIA.values())
+
+class Ranking:
+    """This class ranks schedules by a sort key computed once per schedule,
+    comparing criteria in priority order or by weighted score."""
+    def __init__(self, priorities=(), weights=None, key=None):
+        if weights is not None:
+            names = list(weights)
+            self.weights = [weights[name] for name in names]
+        else:
+            names = list(priorities)
+            self.weights = None
+        for name in names:
+            if name not in CRITERIA:
+                raise ValueError("Unknown ranking criterion: %s" % name)
+        self.criteria = [CRITERIA[name] for name in names]
+        self.custom_key = key
+
+    def key(self, schedule_object):
+        """Returns the sort key of a schedule."""
+        if self.custom_key is not None:
+            return self.custom_key(schedule_object)
+        if self.weights is not None:
+            score = 0
+            for weight, criterion in zip(self.weights, self.criteria):
+                score = score + weight * criterion.key(schedule_object)[0]
+            return (schedule_object.tba_count, score)
+        key = (schedule_object.tba_count,)
+        for criterion in self.criteria:
+            key += criterion.key(schedule_object)
+        return key
+
+    def sort(self, schedule_list):
+        """Returns the schedules ordered from best to worst. Ties keep the
+        order in which the schedules were found."""
+        return sorted(schedule_list, key=self.key)
+
+    def can_bound(self):
+        """Returns True if bound_key gives a valid optimistic bound. Weighted
+        rankings can only be bounded when no weight is negative."""
+        if self.custom_key is not None:
+            return False
+        return self.weights is None or all(weight >= 0 for weight in self.weights)
+
+    def describe(self):
+        """Returns a hashable description of the ranking, equal for rankings
+        that compute the same keys, or None if it has a custom key."""
+        if self.custom_key is not None:
+            return None
+        names = tuple(criterion.name for criterion in self.criteria)
+        if self.weights is None:
+            return ("priorities", names)
+        return ("weights", tuple(zip(names, self.weights)))
+
+    def bound_key(self, partial, remaining):
+        """Returns a sort key no worse than that of any schedule completing
+        the partial schedule."""
+        bound = Schedule(None)
+        bound.tba_count = partial.tba_count
+        for criterion in self.criteria:
+            criterion.bound(bound, partial, remaining)
+        return self.key(bound)
+
+def get_comparison_ranking(primary_compare, secondary_compare):
+    """Returns the Ranking that orders schedules the same way as
+    compare_generic with the given comparators."""
+    if primary_compare in COMPARATOR_CRITERIA and \
+       secondary_compare in COMPARATOR_CRITERIA:
+        return Ranking([COMPARATOR_CRITERIA[primary_compare].name,
+                        COMPARATOR_CRITERIA[secondary_compare].name])
+    return Ranking(key=functools.cmp_to_key(lambda s1, s2:
+        compare_generic(s1, s2, primary_compare, secondary_compare)))
+
 def compare_generic(s1, s2, primary_compare, secondary_compare):
     """Takes in two comparator functions. Makes decisions based on primary_compare
     first and then uses secondary_compare to break ties."""
@@ -195,6 +1655,6 @@ def compare_generic(s1, s2, primary_compare, secondary_compare):
         return 1
 
 def sort_schedules(schedule_list, primary_compare, secondary_compare):
-    """Compares two sections using the commpare_generic() helper method."""
-    return sorted(schedule_list, cmp=lambda s1, s2: 
-                  compare_generic(s1, s2, primary_compare, secondary_compare))
+    """Sorts schedules in the order given by the compare_generic() helper
+    method, computing each schedule's sort key once."""
+    return get_comparison_ranking(primary_compare, secondary_compare).sort(schedule_list)
@@ -3,12 +3,32 @@ import colorsys, math, pickle, os, re
 from flask import current_app, Flask, jsonify, request
 from functools import wraps
 
-import data_scraper, scheduler
+import beam_search, data_scraper, parallel_scheduler, schedule_cache, scheduler
 
 app = Flask(__name__)
 
 COURSE_DATA = None
 
+# The number of worker processes used to search for schedules in parallel. If
+# this is 0, schedules are searched for in the server process
+SCHEDULER_WORKERS = 0
+
+# The number of seconds a request may spend searching for schedules. When it
+# runs out, the best schedule found so far is returned
+SCHEDULE_TIME_LIMIT = 5.0
+
+# Requests whose search could have to visit more than this many schedules are
+# answered by the beam search, which bounds how far its schedule may be from
+# the best one. On generated catalogs the depth first search finished within
+# SCHEDULE_TIME_LIMIT for most requests up to 10 ** 17, and for none above
+# 10 ** 18. Below that it found better schedules than the beam search more
+# often than not, and above it the two found schedules equally good
+BEAM_SEARCH_SIZE = 10 ** 18
+
+# Whether the work done by every schedule search is logged. A single request
+# can also ask for it to be returned with the argument stats=1
+LOG_SEARCH_STATS = False
+
 # JSONP wrapper from https://gist.github.com/farazdagi/1089923
 def support_jsonp(f):
     """Wraps JSONified output for JSONP"""
@@ -28,15 +48,8 @@ def support_jsonp(f):
 def schedule():
     """Verifies and computes an optimal schedule for a list of courses"""
 
-    # Since dictionaries cannot be passed directly through the request
-    # parameters, we need to recreate the map from input fields to classes
-    class_dict = {}
-    for class_string in request.args.getlist("classes[]"):
-        key, value = class_string.split(":", 1)
-        class_dict[key] = value
-
     # Validate the input dictionary
-    validate_response = validate(class_dict)
+    validate_response = validate(get_class_dict(request.args))
 
     # If one or more of the inputs was invalid, return a response of the form
     # {"error": [key_of_invalid_input_1, key_of_invalid_input_2, ...]}
@@ -51,25 +64,187 @@ def schedule():
         course_list = validate_response["result"]["courses"]
         section_list = validate_response["result"]["sections"]
 
-        # Retrieve the primary and secondary comparison functions from the
-        # input fields
-        primary_compare = get_comparison_function(request.args["primaryCompare"])
-        secondary_compare = get_comparison_function(request.args["secondaryCompare"])
-
-        # Compute the list of optimal schedules
-        schedules = scheduler.find_schedules(course_list, section_list, primary_compare, secondary_compare)
-
-        # If no valid schedules exist, return an appropriate response
-        if len(schedules) == 0:
+        # If no classes were entered, there is nothing to schedule
+        if not course_list and not section_list:
+            return jsonify({"result": "No classes were entered.", "optimal": True})
+
+        # Build the ranking of schedules from the user's preferences, and the
+        # constraints every schedule must meet
+        try:
+            ranking = get_ranking(request.args)
+            constraints = get_constraints(request.args)
+        except ValueError as error:
+            return jsonify({"error": [str(error)]})
+
+        # Compute the optimal schedule, using the worker processes if they
+        # were started, or reuse the result of an identical earlier request.
+        # Only the best schedule is displayed, so there is no need to keep any
+        # others during the search. The search is cut off after
+        # SCHEDULE_TIME_LIMIT seconds so that the response time stays bounded
+        budget = scheduler.SearchBudget(SCHEDULE_TIME_LIMIT)
+
+        # Only record the work of the search when it will be reported, so that
+        # the search runs at full speed otherwise
+        stats = None
+        if LOG_SEARCH_STATS or request.args.get("stats"):
+            stats = scheduler.SearchStats()
+        response = {}
+
+        # Very large requests get the beam search instead, which finishes with
+        # the depth first search and also reports how far its schedule may be
+        # from the best one, in the units of the first ranking criterion. Its
+        # results are not cached, since they are rarely proven to be the best
+        if scheduler.estimate_search_size(course_list, section_list,
+                                          constraints) > BEAM_SEARCH_SIZE:
+            schedules, bound = beam_search.find_schedules_beam(
+                course_list, section_list, ranking, top_k=1, budget=budget,
+                constraints=constraints, stats=stats)
+            response["gap"] = beam_search.get_gap(schedules, ranking, bound)
+        else:
+            schedules = schedule_cache.find_schedules_cached(
+                course_list, section_list, ranking, top_k=1, budget=budget, stats=stats,
+                constraints=constraints)
+        optimal = not budget.exhausted
+        if stats is not None:
+            # The counters of the result caches are reported with the search
+            stats_dict = stats.to_dict()
+            stats_dict["caches"] = schedule_cache.get_cache_stats()
+        if LOG_SEARCH_STATS:
+            app.logger.info("Search statistics for %s: %s",
+                            request.query_string, stats_dict)
+        response["optimal"] = optimal
+        if request.args.get("stats"):
+            response["stats"] = stats_dict
+
+        # If no valid schedules exist, return an appropriate response, naming
+        # the smallest set of classes that cannot be taken together so that
+        # the user can fix the request at once
+        if len(schedules) == 0 and optimal:
+            conflicts = get_conflicts(course_list, section_list, constraints, budget)
             html = "No valid schedules could be found."
+            if conflicts and constraints is not None:
+                html += " These classes cannot be taken together within the " + \
+                        "given constraints: " + ", ".join(conflicts)
+            elif conflicts:
+                html += " These classes cannot be taken together: " + \
+                        ", ".join(conflicts)
+            response["conflicts"] = conflicts
+        elif len(schedules) == 0:
+            html = "No valid schedules could be found in the time available."
 
         # Otherwise, return the schedule as an HTML table
-        else:
+        elif optimal:
             html = "Optimized Schedule:<br /><br />" + schedule_to_html(schedules[0])
             # html += "<br />Random Schedule:<br /><br />" + schedule_to_html(schedules[-1])
+        else:
+            html = "Best Schedule Found:<br /><br />" + schedule_to_html(schedules[0])
+
+        # Return the response as a JSON-encoded dictionary, with a flag saying
+        # whether the schedule is proven to be optimal
+        response["result"] = html
+        return jsonify(response)
 
-        # Return the response as a JSON-encoded dictionary
-        return jsonify({"result": html})
+# The /api/count/ route provides API access for counting possible schedules
+@app.route("/api/count/", methods=["GET"])
+@support_jsonp
+def count():
+    """Verifies a list of courses and counts its possible schedules"""
+
+    # Validate the input dictionary
+    validate_response = validate(get_class_dict(request.args))
+
+    # If one or more of the inputs was invalid, return a response of the form
+    # {"error": [key_of_invalid_input_1, key_of_invalid_input_2, ...]}
+    if "error" in validate_response:
+        return jsonify(validate_response)
+
+    # Otherwise, count the schedules meeting the constraints without building
+    # any of them
+    course_list = validate_response["result"]["courses"]
+    section_list = validate_response["result"]["sections"]
+
+    # If no classes were entered, there is nothing to count
+    if not course_list and not section_list:
+        return jsonify({"result": "No classes were entered.", "exact": True})
+    try:
+        constraints = get_constraints(request.args)
+    except ValueError as error:
+        return jsonify({"error": [str(error)]})
+
+    # Count for at most SCHEDULE_TIME_LIMIT seconds. If time runs out, the
+    # count is a lower bound and is marked as not exact
+    budget = scheduler.SearchBudget(SCHEDULE_TIME_LIMIT)
+    schedule_count = scheduler.count_schedules(course_list, section_list, constraints,
+                                               budget)
+    return jsonify({"result": schedule_count, "exact": not budget.exhausted})
+
+# The /api/pareto/ route provides API access for computing every schedule that
+# is not beaten on all ranking criteria at once by another schedule
+@app.route("/api/pareto/", methods=["GET"])
+@support_jsonp
+def pareto():
+    """Verifies a list of courses and computes its non-dominated schedules"""
+
+    # Validate the input dictionary
+    validate_response = validate(get_class_dict(request.args))
+
+    # If one or more of the inputs was invalid, return a response of the form
+    # {"error": [key_of_invalid_input_1, key_of_invalid_input_2, ...]}
+    if "error" in validate_response:
+        return jsonify(validate_response)
+
+    # Otherwise, compute the non-dominated schedules within the time limit and
+    # return them as a list of HTML tables, with a flag saying whether the
+    # search finished
+    course_list = validate_response["result"]["courses"]
+    section_list = validate_response["result"]["sections"]
+
+    # If no classes were entered, there is nothing to schedule
+    if not course_list and not section_list:
+        return jsonify({"result": "No classes were entered.", "optimal": True})
+    try:
+        constraints = get_constraints(request.args)
+    except ValueError as error:
+        return jsonify({"error": [str(error)]})
+    budget = scheduler.SearchBudget(SCHEDULE_TIME_LIMIT)
+    schedules = scheduler.pareto_schedules(course_list, section_list, budget,
+                                           constraints)
+    return jsonify({"result": [schedule_to_html(schedule_object)
+                               for schedule_object in schedules],
+                    "optimal": not budget.exhausted})
+
+def get_conflicts(course_list, section_list, constraints=None, budget=None):
+    """Returns the names of a smallest set of the given courses and sections
+    that cannot be taken together within the given constraints."""
+
+    # Look for the conflicting classes with whatever is left of the request's
+    # budget, or for at most SCHEDULE_TIME_LIMIT seconds without one
+    if budget is None:
+        budget = scheduler.SearchBudget(SCHEDULE_TIME_LIMIT)
+    conflicting_subset = scheduler.find_conflicting_subset(course_list, section_list,
+                                                           budget, constraints,
+                                                           known_infeasible=True)
+    if conflicting_subset is None:
+        return []
+    courses, sections = conflicting_subset
+    names = ["%s-%s" % (course.department.name, course.code) for course in courses]
+    for section in sections:
+        course = section.group.course
+        names.append("%s-%s-%s" % (course.department.name, course.code,
+                                   section.section_number))
+    return names
+
+def get_class_dict(args):
+    """Returns the map from input fields to classes given in the request
+    arguments"""
+
+    # Since dictionaries cannot be passed directly through the request
+    # parameters, we need to recreate the map from input fields to classes
+    class_dict = {}
+    for class_string in args.getlist("classes[]"):
+        key, value = class_string.split(":", 1)
+        class_dict[key] = value
+    return class_dict
 
 def validate(class_dict):
     """Returns {"result": {"courses": [c1, c2, ...], "sections": [s1, s2, ...]}}
@@ -188,7 +363,12 @@ def frange(start, stop, step):
 def schedule_to_html(schedule_object):
     """Returns an HTML table representation of a schedule"""
 
-    schedule = schedule_object.schedule
+    # Sections whose meeting information is TBA have no place in the table,
+    # so they are listed below it
+    schedule = [section for section in schedule_object.schedule
+                if section.meetings is not None]
+    tba_sections = [section for section in schedule_object.schedule
+                    if section.meetings is None]
     earliest_start_time = schedule_object.earliest_time
     latest_end_time = schedule_object.latest_time
 
@@ -205,7 +385,7 @@ def schedule_to_html(schedule_object):
 
     # Variables used to compute background colors that are evenly distributed
     # over the spectrum
-    hue_increment = 300 / len(schedule)
+    hue_increment = 300 / max(len(schedule), 1)
     current_hue = 0
 
     # For each section in the schedule
@@ -217,9 +397,7 @@ def schedule_to_html(schedule_object):
         for meeting in section.meetings:
 
             # Set the cell text to DEPT-###-###
-            cell_text = "%s-%s-%s" % (section.group.course.department.name,
-            	                      section.group.course.code,
-            	                      section.section_number)
+            cell_text = get_section_name(section)
 
             # Compute the number of rows the meeting will occupy in the table,
             # where each row occupies one 30-minute block
@@ -301,39 +479,137 @@ def schedule_to_html(schedule_object):
         # Add the closing row tag
         html_string += "</tr>"
 
+    # Add the closing table tag, followed by the TBA sections
+    html_string += "</table>"
+    if tba_sections:
+        html_string += "<br />TBA: " + ", ".join(get_section_name(section)
+                                                 for section in tba_sections)
+
     # Return the HTML table representation of the schedule
     return html_string
 
-def get_comparison_function(name):
-    """Returns the comparison function of the given name"""
-
-    if name == "early":
-        return scheduler.compare_early
-    elif name == "late":
-        return scheduler.compare_late
-    elif name == "compact":
-        return scheduler.compare_compact
-    elif name == "minGaps":
-        return scheduler.compare_gaps
-    elif name == "minDays":
-        return scheduler.compare_days
+def get_section_name(section):
+    """Returns the name of a section in the form DEPT-###-###"""
+    return "%s-%s-%s" % (section.group.course.department.name,
+                         section.group.course.code, section.section_number)
+
+def get_ranking(args):
+    """Returns the scheduler.Ranking described by the request arguments. Raises
+    a ValueError holding the name of the first malformed argument."""
+
+    # Parse the weights, if any, into a dictionary from criteria to weights
+    weight_strings = args.getlist("weights[]")
+    if weight_strings:
+        weights = {}
+        for weight_string in weight_strings:
+            try:
+                name, weight = weight_string.split(":", 1)
+                weight = float(weight)
+            except ValueError:
+                raise ValueError("weights[]")
+            if name not in scheduler.CRITERIA or math.isinf(weight) or math.isnan(weight):
+                raise ValueError("weights[]")
+            weights[name] = weight
+        return scheduler.Ranking(weights=weights)
+
+    # Otherwise, rank the criteria lexicographically in priority order
+    priorities = args.getlist("compare[]")
+    if priorities:
+        if any(name not in scheduler.CRITERIA for name in priorities):
+            raise ValueError("compare[]")
+        return scheduler.Ranking(priorities)
+    for arg_name in ["primaryCompare", "secondaryCompare"]:
+        if args.get(arg_name) not in scheduler.CRITERIA:
+            raise ValueError(arg_name)
+    return scheduler.Ranking([args["primaryCompare"], args["secondaryCompare"]])
+
+def get_constraints(args):
+    """Returns the scheduler.ScheduleConstraints described by the request
+    arguments, or None if there are none. Raises a ValueError holding the name
+    of the first malformed argument."""
+
+    blocked = []
+    for blocked_string in args.getlist("blocked[]"):
+        try:
+            days, times = blocked_string.split(":", 1)
+            start_time, end_time = [parse_hours(hours, "blocked[]")
+                                    for hours in times.split("-", 1)]
+        except ValueError:
+            raise ValueError("blocked[]")
+        if not days or any(day not in scheduler.DAYS for day in days.upper()) or \
+           not start_time < end_time:
+            raise ValueError("blocked[]")
+        blocked.append((days.upper(), start_time, end_time))
+
+    # Parse the remaining constraints, which are absent unless given
+    times = {}
+    for name in ["earliestTime", "latestTime"]:
+        times[name] = None
+        if args.get(name):
+            times[name] = parse_hours(args[name], name)
+    # Classes could neither start nor end if the window were empty
+    if times["earliestTime"] is not None and times["latestTime"] is not None and \
+       not times["earliestTime"] < times["latestTime"]:
+        raise ValueError("latestTime")
+    free_days = args.get("freeDays", "").upper()
+    if any(day not in scheduler.DAYS for day in free_days):
+        raise ValueError("freeDays")
+    max_days = None
+    if args.get("maxDays"):
+        try:
+            max_days = int(args["maxDays"])
+        except ValueError:
+            raise ValueError("maxDays")
+        if not 1 <= max_days <= len(scheduler.DAYS):
+            raise ValueError("maxDays")
+
+    if not blocked and times["earliestTime"] is None and \
+       times["latestTime"] is None and not free_days and max_days is None:
+        return None
+    return scheduler.ScheduleConstraints(blocked, times["earliestTime"],
+                                         times["latestTime"], free_days, max_days)
+
+def parse_hours(hours_string, name):
+    """Returns a time of day given in hours as a float. Raises a ValueError
+    holding the name of the argument if it is not a number from 0 to 24, which
+    also rejects infinite and NaN values."""
+    try:
+        hours = float(hours_string)
+    except ValueError:
+        raise ValueError(name)
+    if not 0 <= hours <= 24:
+        raise ValueError(name)
+    return hours
 
 if __name__ == "__main__":
 
     # Check if the data file already exists
 
-    # If not, scrape the course data and store it locally
+    # If not, scrape the course data, precompute the occupancy bitmask of
+    # every section and the catalog's conflict index, and store them locally
     if not os.path.exists("course_data.pickle"):
         COURSE_DATA = data_scraper.parse_course_data()
-        pickle.dump(COURSE_DATA, open("course_data.pickle", "w"))
+        scheduler.compile_course_data(COURSE_DATA)
+        pickle.dump(COURSE_DATA, open("course_data.pickle", "wb"),
+                    pickle.HIGHEST_PROTOCOL)
 
-    # Otherwise, load the course data
+    # Otherwise, load the course data, compiling and storing it again if it
+    # was stored before it was compiled
     else:
-        COURSE_DATA = pickle.load(open("course_data.pickle", "r"))
+        COURSE_DATA = pickle.load(open("course_data.pickle", "rb"))
+        if not scheduler.is_compiled(COURSE_DATA):
+            scheduler.compile_course_data(COURSE_DATA)
+            pickle.dump(COURSE_DATA, open("course_data.pickle", "wb"),
+                        pickle.HIGHEST_PROTOCOL)
 
     # Set the global COURSE_DATA object in the scheduler module to the
     # server's COURSE_DATA object
     scheduler.COURSE_DATA = COURSE_DATA
 
+    # If enabled, start the worker processes, each with its own copy of the
+    # course data
+    if SCHEDULER_WORKERS:
+        parallel_scheduler.start_worker_pool(COURSE_DATA, SCHEDULER_WORKERS)
+
     # Debug mode should be turned off when you are finished
     app.run(debug=False)